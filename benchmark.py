@@ -0,0 +1,77 @@
+import os
+import time
+import argparse
+import tracemalloc
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.raindrop import sprite_cache, remap_cache
+from raindrop.config import cfg
+from raindrop.rng import makeRng
+
+from PIL import Image
+import numpy as np
+
+
+def spriteBytes():
+	"""
+	Bytes held by the cached label/alpha sprites and the average per sprite
+	"""
+	sprites = list(sprite_cache._data.values())
+	total = sum(label.nbytes + alpha.nbytes for label, alpha in sprites)
+	return total, total / max(len(sprites), 1)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Time generateDrops on the images of a folder")
+	parser.add_argument("--images", default="./datasets", help="folder with input images")
+	parser.add_argument("--repeat", type=int, default=3, help="renders per image")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--drops", type=int, default=None, help="fixed number of drops")
+	parser.add_argument("--minR", type=int, default=None)
+	parser.add_argument("--maxR", type=int, default=None)
+	parser.add_argument("--collision-mode", default=None, choices=["raster", "analytic"])
+	parser.add_argument("--placement", default=None, choices=["uniform", "poisson"])
+	args = parser.parse_args()
+
+	bench_cfg = dict(cfg)
+	bench_cfg["return_label"] = True
+	if args.drops is not None:
+		bench_cfg["maxDrops"] = bench_cfg["minDrops"] = args.drops
+	if args.minR is not None:
+		bench_cfg["minR"] = args.minR
+	if args.maxR is not None:
+		bench_cfg["maxR"] = args.maxR
+	if args.collision_mode is not None:
+		bench_cfg["collision_mode"] = args.collision_mode
+	if args.placement is not None:
+		bench_cfg["placement"] = args.placement
+
+	# decode up front, only rendering is timed
+	images = []
+	for file_name in sorted(os.listdir(args.images)):
+		if file_name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+			images.append((file_name, np.asarray(Image.open(os.path.join(args.images, file_name)).convert("RGB"))))
+	if not images:
+		print(f"No images found in {args.images}")
+		return
+
+	rng = makeRng(args.seed)
+	timings = []
+	tracemalloc.start()
+	for file_name, image in images:
+		for _ in range(args.repeat):
+			start = time.perf_counter()
+			generateDropsFromImage(image, bench_cfg, as_array=True, rng=rng)
+			timings.append(time.perf_counter() - start)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	timings = np.array(timings) * 1000
+	total, per_sprite = spriteBytes()
+	print(f"images: {len(images)} x {args.repeat} renders")
+	print(f"render time: mean {timings.mean():.1f} ms, median {np.median(timings):.1f} ms, max {timings.max():.1f} ms")
+	print(f"peak traced memory: {peak / 2**20:.1f} MiB")
+	print(f"sprite cache: {sprite_cache.info()}, {total / 2**20:.1f} MiB, {per_sprite / 1024:.1f} KiB per sprite")
+	print(f"remap cache: {remap_cache.info()}")
+
+if __name__ == "__main__":
+	main()
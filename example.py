@@ -1,10 +1,31 @@
 import os
-from raindrop.dropgenerator import generateDrops
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.encoders import BackgroundWriter, encodeImage, encodeLabel, writeEncoded
+from raindrop.rendercache import RenderCache, renderKey
+from raindrop.batch import imageSeed
 from raindrop.config import cfg
 
-from PIL import Image
-import numpy as np
-import cv2
+def saveEncoded(save_path, label_save_path, encoded):
+	image_ext, image_data, label_ext, label_data = encoded
+	try:
+		print(f"Saved image: {writeEncoded(save_path, image_ext, image_data)}")
+		print(f"Saved label: {writeEncoded(label_save_path, label_ext, label_data)}")
+	except Exception as e:
+		print(f"Error saving {save_path}: {str(e)}")
+
+def saveOutputs(save_path, output_image, label_save_path, output_label, run_cfg, cache, key):
+	try:
+		ext = os.path.splitext(save_path)[1]
+		encoded = encodeImage(output_image, run_cfg, ext) + encodeLabel(output_label, run_cfg, ext)
+	except Exception as e:
+		print(f"Error saving {save_path}: {str(e)}")
+		return
+	# the cache only speeds up reruns, the outputs are written even if it fails
+	try:
+		cache.put(key, *encoded)
+	except OSError as e:
+		print(f"Error caching {save_path}: {str(e)}")
+	saveEncoded(save_path, label_save_path, encoded)
 
 def main():
 	# Updated paths for the new project structure
@@ -24,36 +45,44 @@ def main():
 		print(f"Warning: {image_folder_path} not found. Please add images to the datasets directory.")
 		return
 	
-	for file_name in os.listdir(image_folder_path):
-		# Skip non-image files
-		if not file_name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-			continue
-			
-		image_path = os.path.join(image_folder_path, file_name)
-		print(f"Processing: {file_name}")
-		
-		try:
-			# Enable label output
-			cfg["return_label"] = True
-			
-			# Generate both image and label
-			output_image, output_label = generateDrops(image_path, cfg)
-			
-			# Save processed image
-			save_path = os.path.join(outputimg_folder_path, file_name)
-			output_image.save(save_path)
-			print(f"Saved image: {save_path}")
-			
-			# Save label map
-			label_save_path = os.path.join(outputlabel_folder_path, file_name)
-			# Convert label to proper format for saving
-			output_label_array = np.array(output_label)
-			# Multiply by 255 to make labels visible (0 -> 0, 1 -> 255)
-			cv2.imwrite(label_save_path, output_label_array * 255)
-			print(f"Saved label: {label_save_path}")
+	# Enable label output on a copy, the shared cfg stays untouched
+	run_cfg = dict(cfg, return_label=True)
+	# every image is seeded from its name, so reruns give the same drops
+	seed = 0
+	# reruns copy unchanged images (same input, cfg and seed) from the cache
+	cache = RenderCache("./.render_cache", max_bytes=512 << 20)
+	
+	# encode and write on background threads while the next image renders
+	with BackgroundWriter(threads=2) as writer:
+		for file_name in os.listdir(image_folder_path):
+			# Skip non-image files
+			if not file_name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+				continue
+				
+			image_path = os.path.join(image_folder_path, file_name)
+			print(f"Processing: {file_name}")
 			
-		except Exception as e:
-			print(f"Error processing {file_name}: {str(e)}")
+			try:
+				save_path = os.path.join(outputimg_folder_path, file_name)
+				label_save_path = os.path.join(outputlabel_folder_path, file_name)
+				with open(image_path, "rb") as f:
+					data = f.read()
+				image_seed = imageSeed(seed, file_name)
+				ext = os.path.splitext(file_name)[1]
+				key = renderKey(data, run_cfg, image_seed, ext, ext)
+				cached = cache.get(key)
+				if cached is not None:
+					writer.submit(saveEncoded, save_path, label_save_path, cached)
+					continue
+				
+				# Generate both image and label
+				output_image, output_label = generateDropsFromImage(data, run_cfg, as_array=True, rng=image_seed)
+				
+				# Save processed image and label map, labels are scaled to 0/255 by encodeLabel
+				writer.submit(saveOutputs, save_path, output_image, label_save_path, output_label, run_cfg, cache, key)
+				
+			except Exception as e:
+				print(f"Error processing {file_name}: {str(e)}")
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
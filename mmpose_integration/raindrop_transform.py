@@ -1,13 +1,12 @@
 """
 MMPose custom transform for raindrop augmentation
 """
-import random
-import numpy as np
-import tempfile
 import os
-from PIL import Image
+import multiprocessing
+import numpy as np
 from mmcv.transforms import BaseTransform
-from mmpose.registry import TRANSFORMS
+from mmengine.hooks import Hook
+from mmpose.registry import HOOKS, TRANSFORMS
 
 # Import ROLE raindrop generation from project
 import sys
@@ -18,7 +17,8 @@ parent_dir = osp.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-from raindrop.dropgenerator import generateDrops
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.rng import makeRng, sampleSeed
 
 
 @TRANSFORMS.register_module()
@@ -32,13 +32,27 @@ class RaindropAugmentation(BaseTransform):
     Args:
         probability (float): Probability of applying raindrop effect (0.0-1.0).
         raindrop_config (dict): Configuration for raindrop generation.
-        temp_dir (str): Temporary directory for intermediate files.
+        temp_dir (str): Unused, kept so existing configs still build. Images
+            are rendered in memory.
+        seed (int, optional): Run seed. When given, every sample draws from
+            its own generator seeded with (seed, epoch, results['sample_idx']),
+            so augmentations are reproducible whatever the number of
+            dataloader workers; add ``RaindropEpochHook`` to custom_hooks so
+            the epoch advances. When None, every worker process seeds its own
+            generator from OS entropy, so forked workers do not repeat each
+            other's drops.
     """
     
-    def __init__(self, probability=0.4, raindrop_config=None, temp_dir='/tmp'):
+    def __init__(self, probability=0.4, raindrop_config=None, temp_dir='/tmp', seed=None):
         super().__init__()
         self.probability = probability
         self.temp_dir = temp_dir
+        self.seed = seed
+        # shared memory, so set_epoch in the main process reaches the copies
+        # of the transform held by (persistent) dataloader workers
+        self._epoch = multiprocessing.RawValue('q', 0)
+        self._rng = None
+        self._rng_pid = None
         
         # Default raindrop configuration optimized for pose estimation
         self.default_config = {
@@ -58,9 +72,6 @@ class RaindropAugmentation(BaseTransform):
             self.raindrop_config = {**self.default_config, **raindrop_config}
         else:
             self.raindrop_config = self.default_config
-            
-        # Ensure temp directory exists
-        os.makedirs(self.temp_dir, exist_ok=True)
     
     def transform(self, results):
         """
@@ -72,29 +83,20 @@ class RaindropAugmentation(BaseTransform):
         Returns:
             dict: Data dict with augmented image.
         """
+        rng = self._sample_rng(results)
         # Skip augmentation based on probability
-        if random.random() > self.probability:
+        if rng.random() > self.probability:
             return results
             
         try:
             # Get image from results
             img = results['img']  # numpy array in BGR format
             
-            # Convert BGR to RGB for PIL
-            img_rgb = img[:, :, ::-1]  # BGR -> RGB
-            
-            # Convert to PIL Image
-            img_pil = Image.fromarray(img_rgb.astype(np.uint8))
-            
-            # Apply raindrop effect using temporary file approach
-            augmented_img = self._apply_raindrop_effect(img_pil)
-            
-            # Convert back to numpy array in BGR format
-            augmented_array = np.array(augmented_img)
-            augmented_bgr = augmented_array[:, :, ::-1]  # RGB -> BGR
+            # Apply raindrop effect directly on the BGR array
+            augmented_img = self._apply_raindrop_effect(img, rng)
             
             # Update results
-            results['img'] = augmented_bgr.astype(img.dtype)
+            results['img'] = augmented_img.astype(img.dtype, copy=False)
             
         except Exception as e:
             # If raindrop generation fails, return original image
@@ -102,38 +104,77 @@ class RaindropAugmentation(BaseTransform):
             
         return results
     
-    def _apply_raindrop_effect(self, img_pil):
+    @property
+    def epoch(self):
+        return self._epoch.value
+    
+    def set_epoch(self, epoch):
         """
-        Apply raindrop effect using ROLE library.
+        Set the epoch seeded samples are drawn for, see RaindropEpochHook.
         
         Args:
-            img_pil (PIL.Image): Input PIL image.
+            epoch (int): Current training epoch.
+        """
+        self._epoch.value = int(epoch)
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # spawned dataloader workers share the epoch, deepcopies and other
+        # pickles (which can not hold shared memory) get its current value
+        if multiprocessing.context.get_spawning_popen() is None:
+            state['_epoch'] = self.epoch
+        return state
+    
+    def __setstate__(self, state):
+        if isinstance(state['_epoch'], int):
+            state['_epoch'] = multiprocessing.RawValue('q', state['_epoch'])
+        self.__dict__.update(state)
+    
+    def _sample_rng(self, results):
+        """
+        Random generator for one sample.
+        
+        Args:
+            results (dict): Data dict, its 'sample_idx' seeds the sample.
             
         Returns:
-            PIL.Image: Augmented image with raindrop effect.
+            numpy.random.Generator: Generator for the whole sample.
         """
-        # Create temporary file for input
-        with tempfile.NamedTemporaryFile(suffix='.jpg', dir=self.temp_dir, delete=False) as temp_file:
-            temp_path = temp_file.name
-            
-        try:
-            # Save PIL image to temporary file
-            img_pil.save(temp_path, 'JPEG')
-            
-            # Apply raindrop effect
-            augmented_img = generateDrops(temp_path, self.raindrop_config)
-            
-            return augmented_img
+        if self.seed is not None:
+            if 'sample_idx' not in results:
+                raise KeyError(f'{self.__class__.__name__} with seed={self.seed} needs '
+                               "results['sample_idx'] to seed every sample reproducibly")
+            return makeRng(sampleSeed(self.seed, results['sample_idx'], self.epoch))
+        # a generator copied into a forked worker would repeat the parent's stream
+        if self._rng is None or self._rng_pid != os.getpid():
+            self._rng = makeRng()
+            self._rng_pid = os.getpid()
+        return self._rng
+    
+    def _apply_raindrop_effect(self, img, rng=None):
+        """
+        Apply raindrop effect using ROLE library.
+        
+        Every rendering step (blur, refraction, edge darkening, blending)
+        treats the colour channels independently, so the BGR array is fed
+        to the renderer as is and no channel flip is needed either way.
+        
+        Args:
+            img (np.ndarray): Input image in BGR format.
+            rng (numpy.random.Generator, optional): Generator of the sample.
             
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        Returns:
+            np.ndarray: Augmented image in BGR format.
+        """
+        if img.dtype != np.uint8:
+            img = img.astype(np.uint8)
+        return generateDropsFromImage(img, self.raindrop_config, as_array=True, rng=rng)
     
     def __repr__(self):
         repr_str = (f'{self.__class__.__name__}('
                    f'probability={self.probability}, '
-                   f'raindrop_config={self.raindrop_config})')
+                   f'raindrop_config={self.raindrop_config}, '
+                   f'seed={self.seed})')
         return repr_str
 
 
@@ -146,7 +187,7 @@ class RaindropAugmentationStage1(RaindropAugmentation):
     the initial training phase.
     """
     
-    def __init__(self, probability=0.4, temp_dir='/tmp'):
+    def __init__(self, probability=0.4, temp_dir='/tmp', seed=None):
         # Stage 1 specific configuration
         stage1_config = {
             'maxR': 25,
@@ -160,8 +201,43 @@ class RaindropAugmentationStage1(RaindropAugmentation):
         
         super().__init__(probability=probability, 
                         raindrop_config=stage1_config,
-                        temp_dir=temp_dir)
+                        temp_dir=temp_dir,
+                        seed=seed)
+
+
+def _raindrop_transforms(dataset):
+    """
+    Yield the RaindropAugmentation transforms of a dataset's pipeline,
+    looking through dataset wrappers (ConcatDataset, RepeatDataset, ...).
+    """
+    for inner in getattr(dataset, 'datasets', ()):
+        yield from _raindrop_transforms(inner)
+    if hasattr(dataset, 'dataset'):
+        yield from _raindrop_transforms(dataset.dataset)
+    pipeline = getattr(dataset, 'pipeline', None)
+    for transform in getattr(pipeline, 'transforms', ()):
+        if isinstance(transform, RaindropAugmentation):
+            yield transform
+
+
+@HOOKS.register_module()
+class RaindropEpochHook(Hook):
+    """
+    Advance the epoch of the seeded raindrop transforms in the train pipeline.
+    
+    Seeded RaindropAugmentation derives every sample's drops from
+    (seed, epoch, sample_idx); this hook sets the epoch before every training
+    epoch, so samples get new drops each epoch while staying reproducible.
+    The epoch lives in shared memory, so workers of a dataloader with
+    persistent_workers=True see it as well.
+    """
+    
+    priority = 'NORMAL'
+    
+    def before_train_epoch(self, runner):
+        for transform in _raindrop_transforms(runner.train_dataloader.dataset):
+            transform.set_epoch(runner.epoch)
 
 
 # Register the transforms
-__all__ = ['RaindropAugmentation', 'RaindropAugmentationStage1']
\ No newline at end of file
+__all__ = ['RaindropAugmentation', 'RaindropAugmentationStage1', 'RaindropEpochHook']
\ No newline at end of file
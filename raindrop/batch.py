@@ -0,0 +1,426 @@
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from PIL import Image
+
+from .pipeline import iterGenerate, loadImage, Rendered
+from .encoders import encodeImage, encodeLabel, writeEncoded
+from .rendercache import RenderCache, renderKey
+from .shards import ShardWriter, SHARD_NAME, sampleKey, listShards
+from .raindrop import remap_cache, _fisheyeMaps
+from .sources import IMAGE_EXTENSIONS, listArchives, archivePrefix, iterArchive
+"""
+Render whole image folders on a process pool with a resumable JSONL manifest
+
+"""
+
+# per worker process state, set up once by _initWorker
+_worker_cfg = None
+_worker_sharded = False
+_worker_clean = False
+_worker_results = None
+_worker_cache = None
+
+
+def imageSeed(seed, name):
+	"""
+	Seed of one image, fixed by the run seed and the image name so a render
+	does not depend on which worker picks it up or in which order
+	"""
+	return zlib.crc32(f"{seed}:{name}".encode("utf-8"))
+
+
+def listImages(folder):
+	"""
+	Relative paths of the images below folder, sorted
+	"""
+	names = []
+	for root, _, files in os.walk(folder):
+		for file_name in files:
+			if file_name.lower().endswith(IMAGE_EXTENSIONS):
+				names.append(os.path.relpath(os.path.join(root, file_name), folder))
+	return sorted(names)
+
+
+def readManifest(path):
+	"""
+	Map input name -> record of the entries a manifest completed, later lines win
+	lines cut short by an interrupted run are ignored
+	"""
+	done = {}
+	if not os.path.exists(path):
+		return done
+	with open(path, "r", encoding="utf-8") as f:
+		for line in f:
+			try:
+				record = json.loads(line)
+			except ValueError:
+				continue
+			if "error" in record:
+				done.pop(record.get("input"), None)
+			else:
+				done[record["input"]] = record
+	return done
+
+
+def _warmCaches(cfg):
+	"""
+	Build the fisheye maps of every undistorted sprite size a worker will meet
+	"""
+	# None is no distortion, as in refract
+	D = tuple(float(d) for d in cfg.get("distortion_coeffs") or (0.0, 0.0, 0.0, 0.0))
+	for radius in range(cfg["minR"], cfg["maxR"] + 1):
+		h, w = 5*radius, 4*radius
+		remap_cache.get((radius, h, w, D, True), lambda: _fisheyeMaps(radius, h, w, D, True))
+
+
+def _initWorker(cfg, warm, results, sharded = False, clean = False, cache = None):
+	global _worker_cfg, _worker_sharded, _worker_clean, _worker_results, _worker_cache
+	# one OpenCV thread per process, the pool already fills every core
+	cv2.setNumThreads(1)
+	_worker_cfg = dict(cfg)
+	_worker_cfg["return_label"] = True
+	_worker_sharded = sharded
+	_worker_clean = clean
+	_worker_results = results
+	# (folder, max bytes) of the render cache shared by all workers
+	_worker_cache = None if cache is None else RenderCache(*cache)
+	if warm:
+		_warmCaches(_worker_cfg)
+
+
+def _encode(rendered, cfg, record):
+	"""
+	(image ext, image bytes, label ext, label bytes) of a Rendered job, encoded
+	with the extension of its input name and stored in the worker's render cache
+	the cache is best effort: a failed store is noted in record["cache_error"]
+	and the outputs are written all the same
+	"""
+	ext = os.path.splitext(rendered.item[1])[1]
+	encoded = encodeImage(rendered.image, cfg, ext) + encodeLabel(rendered.label, cfg, ext)
+	if _worker_cache is not None:
+		try:
+			_worker_cache.put(_jobKey(rendered.item, cfg), *encoded)
+		except OSError as e:
+			record["cache_error"] = f"{type(e).__name__}: {e}"
+	return encoded
+
+
+def writeOutputs(rendered, cfg = None, encoded = None):
+	"""
+	Write a Rendered job (input path or bytes, name, seed, image output, label output)
+	with the encoders of cfg, the worker's config by default; encoded, a render
+	cache entry, is written as is instead of encoding the render
+	returns the manifest record of the job
+	"""
+	input_path, name, seed, image_path, label_path = rendered.item
+	cfg = _worker_cfg if cfg is None else cfg
+	record = {"input": name, "seed": seed}
+	start = time.perf_counter()
+	try:
+		if rendered.error is not None:
+			raise rendered.error
+		image_ext, image_data, label_ext, label_data = _encode(rendered, cfg, record) if encoded is None else encoded
+		for path in (image_path, label_path):
+			os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		image_path = writeEncoded(image_path, image_ext, image_data)
+		label_path = writeEncoded(label_path, label_ext, label_data)
+	except Exception as e:
+		record["error"] = f"{type(e).__name__}: {e}"
+		return record
+	record.update({
+		"image": image_path,
+		"label": label_path,
+		"render_time": round(rendered.render_time, 4),
+		"write_time": round(time.perf_counter() - start, 4),
+		"worker": os.getpid(),
+	})
+	if encoded is not None:
+		record["cached"] = True
+	return record
+
+
+def encodeOutputs(rendered, cfg = None, clean = None, encoded = None):
+	"""
+	Encode a Rendered job into the members of one shard sample: the rainy image,
+	the label, a metadata JSON and, with clean, the untouched input file;
+	encoded, a render cache entry, is used as is instead of encoding the render
+	returns the manifest record of the job, with the members under "files"
+	"""
+	input_path, name, seed, _, _ = rendered.item
+	cfg = _worker_cfg if cfg is None else cfg
+	clean = _worker_clean if clean is None else clean
+	record = {"input": name, "seed": seed}
+	start = time.perf_counter()
+	try:
+		if rendered.error is not None:
+			raise rendered.error
+		ext = os.path.splitext(name)[1]
+		files = {}
+		if clean and isinstance(input_path, bytes):
+			files["clean" + ext.lower()] = input_path
+		elif clean:
+			with open(input_path, "rb") as f:
+				files["clean" + ext.lower()] = f.read()
+		image_ext, image_data, label_ext, label_data = _encode(rendered, cfg, record) if encoded is None else encoded
+		files["rain" + image_ext.lower()] = image_data
+		files["label" + label_ext.lower()] = label_data
+		if rendered.image is None:
+			# the size is read from the encoded header, the image is not decoded
+			w, h = Image.open(io.BytesIO(image_data)).size
+		else:
+			h, w = rendered.image.shape[:2]
+		files["json"] = json.dumps({"input": name, "seed": seed, "width": w, "height": h}).encode("utf-8")
+	except Exception as e:
+		record["error"] = f"{type(e).__name__}: {e}"
+		return record
+	record.update({
+		"render_time": round(rendered.render_time, 4),
+		"write_time": round(time.perf_counter() - start, 4),
+		"worker": os.getpid(),
+		"files": files,
+	})
+	if encoded is not None:
+		record["cached"] = True
+	return record
+
+
+def _jobSeed(job):
+	return job[2]
+
+
+def _loadJob(job):
+	return loadImage(job[0])
+
+
+def _jobKey(job, cfg):
+	# render cache jobs carry their input bytes, see _uncachedJobs
+	ext = os.path.splitext(job[1])[1]
+	return renderKey(job[0], cfg, job[2], ext, ext)
+
+
+def _uncachedJobs(jobs, writer, send):
+	"""
+	Jobs the render cache does not hold, with their input read into bytes;
+	cached jobs are written from the cache by writer and their records sent,
+	without decoding their input
+	"""
+	for job in jobs:
+		data = job[0]
+		if not isinstance(data, bytes):
+			try:
+				with open(data, "rb") as f:
+					data = f.read()
+			except OSError:
+				# reported by the pipeline like any unreadable input
+				yield job
+				continue
+		job = (data,) + tuple(job[1:])
+		entry = _worker_cache.get(_jobKey(job, _worker_cfg))
+		if entry is None:
+			yield job
+		else:
+			send(writer(Rendered(job, None, None, 0.0, None), encoded=entry))
+
+
+def _renderJobs(jobs, chunk_size, source = None):
+	"""
+	Render jobs through the decode / encode pipeline, their records are sent
+	to the parent in batches of chunk_size; a failure of the job stream itself,
+	e.g. a broken archive, is sent as an error record for source
+	returns the number of records sent
+	"""
+	writer = encodeOutputs if _worker_sharded else writeOutputs
+	count = 0
+	records = []
+
+	def send(record):
+		nonlocal count, records
+		records.append(record)
+		if len(records) >= chunk_size:
+			_worker_results.put(records)
+			count += len(records)
+			records = []
+
+	try:
+		if _worker_cache is not None:
+			jobs = _uncachedJobs(jobs, writer, send)
+		for record in iterGenerate(jobs, _worker_cfg, writer=writer, load=_loadJob, errors="yield", seeds=_jobSeed):
+			send(record)
+	except Exception as e:
+		records.append({"input": source, "error": f"{type(e).__name__}: {e}"})
+	if records:
+		_worker_results.put(records)
+		count += len(records)
+	return count
+
+
+def _renderChunk(jobs):
+	return _renderJobs(jobs, len(jobs))
+
+
+def _renderArchive(path, prefix, seed, image_dir, label_dir, done, chunk_size, part = 0, parts = 1):
+	# members are decoded and encoded next to the renderer like plain files
+	# an archive split into parts is read by every part, each rendering every
+	# parts-th image, and only part 0 reports a broken archive
+	skip = {name[len(prefix) + 1:] for name in done}
+	def jobs():
+		try:
+			for i, (member, data) in enumerate(iterArchive(path, skip)):
+				if i % parts != part:
+					continue
+				name = f"{prefix}/{member}"
+				yield (data, name, imageSeed(seed, name), os.path.join(image_dir, name), os.path.join(label_dir, name))
+		except Exception:
+			if part == 0:
+				raise
+	return _renderJobs(jobs(), chunk_size, prefix)
+
+
+def _progress(done, failed, total, start, stream):
+	elapsed = time.perf_counter() - start
+	rate = done / elapsed if elapsed > 0 else 0.0
+	if total is None:
+		stream.write(f"\r{done} images, {failed} failed, {rate:.1f} img/s ")
+	else:
+		eta = (total - done) / rate if rate > 0 else float("inf")
+		stream.write(f"\r{done}/{total} images, {failed} failed, {rate:.1f} img/s, eta {eta:.0f} s ")
+	stream.flush()
+
+
+def _archiveName(input_dir, path):
+	# archives keep their folder below input_dir, e.g. "train/shard-00" for train/shard-00.tar
+	folder = os.path.relpath(os.path.dirname(path), input_dir)
+	return archivePrefix(path) if folder == "." else os.path.join(folder, archivePrefix(path))
+
+
+def _drain(results, timeout):
+	"""
+	Record batches the workers sent, waiting up to timeout for the first one
+	"""
+	batches = []
+	try:
+		batches.append(results.get(timeout=timeout))
+		while True:
+			batches.append(results.get_nowait())
+	except queue.Empty:
+		pass
+	return batches
+
+
+def runBatch(input_dir, image_dir, label_dir, cfg, manifest_path, seed = 0, workers = None, chunk_size = 8, resume = False, warm = True, shard_dir = None, shard_count = 1000, shard_bytes = 1 << 30, shard_clean = False, cache_dir = None, cache_bytes = 1 << 30, stream = sys.stderr):
+	"""
+	Render every image below input_dir on a pool of worker processes
+	input_dir is a folder or a single archive; images inside tar / zip archives
+	are streamed out of them without extracting, one archive per worker task
+	(split across several when there are fewer archives than workers), and
+	named after the archive, e.g. "shard-00/img/1.jpg" for shard-00.tar
+	outputs keep the relative path of their input under image_dir / label_dir and
+	every finished image appends one line to the JSONL manifest; with resume the
+	images the manifest already completed are skipped
+	with shard_dir the samples are streamed into tar shards there instead (see
+	raindrop.shards.ShardWriter), their manifest lines are written once their
+	shard is complete so resume redoes the samples of an unfinished shard;
+	a fresh run refuses a shard_dir that already holds shards (FileExistsError),
+	whose old samples readers would see next to the new ones
+	with cache_dir, outputs are looked up in and added to a RenderCache there,
+	bounded to cache_bytes; hits are written without decoding their input
+	returns (rendered, failed, skipped)
+	"""
+	if shard_dir is not None and not resume and listShards(shard_dir):
+		raise FileExistsError(f"{shard_dir} already holds shards, resume that run or write the shards to an empty folder")
+	if os.path.isdir(input_dir):
+		names = listImages(input_dir)
+		archives = [(path, _archiveName(input_dir, path)) for path in listArchives(input_dir)]
+	else:
+		names = []
+		archives = [(input_dir, archivePrefix(input_dir))]
+	done = readManifest(manifest_path) if resume else {}
+	jobs = []
+	for name in names:
+		if name in done:
+			continue
+		jobs.append((os.path.join(input_dir, name), name, imageSeed(seed, name), os.path.join(image_dir, name), os.path.join(label_dir, name)))
+	skipped = len(names) - len(jobs)
+	workers = workers or os.cpu_count() or 1
+	# long archive tasks go first, the file chunks fill in around them; with
+	# fewer archives than workers every archive is split so all cores render
+	parts = max(1, workers // len(archives)) if archives else 1
+	tasks = []
+	for path, name in archives:
+		archive_done = {n for n in done if n.startswith(name + "/")}
+		skipped += len(archive_done)
+		for part in range(parts):
+			tasks.append((_renderArchive, path, name, seed, image_dir, label_dir, archive_done, chunk_size, part, parts))
+	tasks += [(_renderChunk, jobs[i:i + chunk_size]) for i in range(0, len(jobs), chunk_size)]
+	# archive sizes are only known once they are read
+	total = None if archives else len(jobs)
+
+	rendered = failed = 0
+	start = time.perf_counter()
+	with open(manifest_path, "a" if resume else "w", encoding="utf-8") as manifest:
+		shard_records = {}
+
+		def shardClosed(path, keys):
+			for key in keys:
+				manifest.write(json.dumps(shard_records.pop(key)) + "\n")
+
+		shards = None
+		if shard_dir is not None:
+			# a fresh run starts in an empty folder, resume continues the series
+			shards = ShardWriter(shard_dir, shard_count, shard_bytes, start = None if resume else 0, on_close = shardClosed)
+		# workers send their records in batches, bounded so they wait for a slow writer
+		results = multiprocessing.Queue(maxsize = 4 * workers)
+		with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(cfg, warm, results, shards is not None, shard_clean, None if cache_dir is None else (cache_dir, cache_bytes))) as pool:
+			# keep a couple of tasks queued per worker, not the whole dataset
+			pending = set()
+			tasks = iter(tasks)
+			expected = received = 0
+			shown = None
+			while True:
+				for task in tasks:
+					pending.add(pool.submit(*task))
+					if len(pending) >= 2 * workers:
+						break
+				if not pending and received == expected:
+					break
+				for records in _drain(results, 0.1):
+					received += len(records)
+					for record in records:
+						if shards is not None and "error" not in record:
+							files = record.pop("files")
+							key = sampleKey(record["input"])
+							if key in shard_records:
+								record["error"] = f"ValueError: sample key {key!r} is taken"
+							else:
+								record.update({"shard": SHARD_NAME.format(shards.number), "key": key})
+								shard_records[key] = record
+								shards.write(key, files)
+								rendered += 1
+								continue
+						if "error" in record:
+							failed += 1
+						else:
+							rendered += 1
+						manifest.write(json.dumps(record) + "\n")
+				for future in [future for future in pending if future.done()]:
+					pending.remove(future)
+					expected += future.result()
+				manifest.flush()
+				# redraw on new results, at least once a second while waiting
+				if (rendered + failed, time.perf_counter() // 1) != shown:
+					shown = (rendered + failed, time.perf_counter() // 1)
+					_progress(rendered + failed, failed, total, start, stream)
+		if shards is not None:
+			shards.close()
+	if rendered + failed:
+		stream.write("\n")
+	return rendered, failed, skipped
@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+"""
+Small in-memory caches shared by the drop generator
+
+"""
+
+
+class LRUCache():
+	"""
+	Bounded least-recently-used cache with hit/miss counters
+	"""
+	def __init__(self, maxsize = 128):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, factory = None):
+		"""
+		Return the cached value for key, building it with factory() on a miss
+		returns None on a miss when no factory is given
+		"""
+		with self._lock:
+			if key in self._data:
+				self._data.move_to_end(key)
+				self.hits += 1
+				return self._data[key]
+			self.misses += 1
+		if factory is None:
+			return None
+		# build outside the lock, a racing thread may build the same value
+		value = factory()
+		self.put(key, value)
+		return value
+
+	def put(self, key, value):
+		with self._lock:
+			self._data[key] = value
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last = False)
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def info(self):
+		return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+	def __len__(self):
+		return len(self._data)
+
+	def __contains__(self, key):
+		return key in self._data
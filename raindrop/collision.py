@@ -0,0 +1,295 @@
+import math
+import numpy as np
+
+from .droptable import clipBoxes
+"""
+Broad and narrow phase collision tests between generated drops
+
+"""
+
+
+class SpatialHash():
+	"""
+	Uniform grid over axis aligned boxes (x0, y0, x1, y1), answers
+	"which items could touch this box" by looking at the few cells it spans
+	"""
+	def __init__(self, cell_size):
+		self.cell_size = max(int(cell_size), 1)
+		self._cells = {}
+		self._boxes = {}
+
+	def _cellRange(self, box):
+		x0, y0, x1, y1 = box
+		c = self.cell_size
+		for cx in range(x0 // c, (x1 - 1) // c + 1):
+			for cy in range(y0 // c, (y1 - 1) // c + 1):
+				yield (cx, cy)
+
+	def insert(self, item, box):
+		self._boxes[item] = box
+		for cell in self._cellRange(box):
+			self._cells.setdefault(cell, set()).add(item)
+
+	def remove(self, item):
+		box = self._boxes.pop(item)
+		for cell in self._cellRange(box):
+			bucket = self._cells[cell]
+			bucket.discard(item)
+			if not bucket:
+				del self._cells[cell]
+
+	def query(self, box):
+		"""
+		Items whose box overlaps the given box
+		"""
+		x0, y0, x1, y1 = box
+		found = set()
+		for cell in self._cellRange(box):
+			found.update(self._cells.get(cell, ()))
+		return [item for item in found if _overlap(self._boxes[item], box)]
+
+	def __contains__(self, item):
+		return item in self._boxes
+
+	def __len__(self):
+		return len(self._boxes)
+
+
+def _overlap(a, b):
+	return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def coversPoint(table, boxes, row, x, y):
+	"""
+	Raster test, true if the row's label sprite is set at image pixel (x, y)
+	"""
+	x0, y0, x1, y1 = boxes[row]
+	if not (x0 <= x < x1 and y0 <= y < y1):
+		return False
+	return table.labelMap(row)[y - y0, x - x0]
+
+
+def touchesBox(table, boxes, row, box):
+	"""
+	Raster test, true if the row's label sprite has pixels inside box (already clipped to the image)
+	"""
+	x0, y0, x1, y1 = boxes[row]
+	L = max(x0, box[0])
+	U = max(y0, box[1])
+	R = min(x1, box[2])
+	D = min(y1, box[3])
+	if L >= R or U >= D:
+		return False
+	return table.labelMap(row)[U - y0:D - y0, L - x0:R - x0].any()
+
+
+def findCollisions(table, index, imgh, imgw, dirty = None):
+	"""
+	Mark the drops whose center lands on an earlier drop of the table
+	they collide with every earlier drop that reaches into their bounding box
+	index is a SpatialHash of every row's box keyed by table.ident; dirty lists
+	the rows added since the last pass, None checks every row. Drops that did
+	not take part in a merge cannot collide with each other, so only dirty rows
+	and the later rows whose center a dirty drop now covers are checked
+	returns the number of colliding drops
+	"""
+	boxes = table.boxes()
+	clip = clipBoxes(boxes, imgh, imgw)[0]
+	row_of = {int(ident): row for row, ident in enumerate(table.ident)}
+	if dirty is None:
+		check = range(len(table))
+	else:
+		check = set(dirty)
+		for d in dirty:
+			for ident in index.query(tuple(boxes[d])):
+				c = row_of[ident]
+				if c > d and coversPoint(table, boxes, d, table.x[c], table.y[c]):
+					check.add(c)
+		check = sorted(check)
+	rows = []
+	col_with = []
+	for n in check:
+		ix, iy = table.x[n], table.y[n]
+		earlier = [row_of[ident] for ident in index.query(tuple(boxes[n])) if row_of[ident] < n]
+		if any(coversPoint(table, boxes, m, ix, iy) for m in earlier):
+			for m in sorted(earlier):
+				if touchesBox(table, boxes, m, clip[n]):
+					rows.append(n)
+					col_with.append(m)
+	table.setCollisions(rows, col_with)
+	return int(table.colli.sum())
+
+
+class UnionFind():
+	"""
+	Disjoint sets over 0..n-1 with path halving and union by size
+	"""
+	def __init__(self, n):
+		self.parent = list(range(n))
+		self.size = [1] * n
+
+	def find(self, i):
+		parent = self.parent
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	def union(self, a, b):
+		a = self.find(a)
+		b = self.find(b)
+		if a == b:
+			return a
+		if self.size[a] < self.size[b]:
+			a, b = b, a
+		self.parent[b] = a
+		self.size[a] += self.size[b]
+		return a
+
+	def groups(self):
+		"""
+		Members of every set in order of their first member
+		"""
+		groups = {}
+		for i in range(len(self.parent)):
+			groups.setdefault(self.find(i), []).append(i)
+		return list(groups.values())
+
+
+def _spritePrimitives(shapes):
+	"""
+	Circle/ellipse primitives of one sprite in sprite coordinates: center x/y,
+	semi axes a/b, rotation (rad) and the arc (start, end) in degrees; circles
+	are full ellipses with a == b
+	"""
+	rows = []
+	for shape in shapes:
+		(sx, sy) = shape[1]
+		if shape[0] == "circle":
+			rows.append((sx, sy, shape[2], shape[2], 0.0, 0, 360))
+		else:
+			(a, b), angle, start, end = shape[2], shape[3], shape[4], shape[5]
+			rows.append((sx, sy, a, b, math.radians(angle), start, end))
+	return np.array(rows, dtype=np.float64).reshape(-1, 7)
+
+
+def _dropPrimitives(table, boxes):
+	"""
+	Footprint primitives of every row in image coordinates, sorted by owner row
+	"""
+	used = np.unique(table.sprite)
+	local = [_spritePrimitives(table.sprites[s].shapes) for s in used]
+	count = np.zeros(len(table.sprites), dtype=np.int64)
+	count[used] = [len(p) for p in local]
+	first = np.zeros(len(table.sprites), dtype=np.int64)
+	first[used] = np.cumsum(count[used]) - count[used]
+	local = np.concatenate(local) if local else np.zeros((0, 7))
+	# gather the primitives of each row's sprite and move them to its box
+	per_row = count[table.sprite]
+	owner = np.repeat(np.arange(len(table)), per_row)
+	p = np.repeat(first[table.sprite], per_row) + np.arange(per_row.sum()) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+	prims = local[p].copy()
+	prims[:, 0] += boxes[owner, 0]
+	prims[:, 1] += boxes[owner, 1]
+	return owner, prims
+
+
+def _primitiveBoxes(prims):
+	"""
+	Axis aligned boxes of the (full, rotated) ellipses, a conservative bound for arcs
+	"""
+	cx, cy, a, b, theta = prims[:, 0], prims[:, 1], prims[:, 2], prims[:, 3], prims[:, 4]
+	c, s = np.cos(theta), np.sin(theta)
+	hw = np.sqrt((a*c)**2 + (b*s)**2)
+	hh = np.sqrt((a*s)**2 + (b*c)**2)
+	return np.stack((cx - hw, cy - hh, cx + hw + 1, cy + hh + 1), axis=1)
+
+
+def _insidePrimitives(px, py, prims):
+	"""
+	Element-wise test of points (px, py) against ellipse sectors prims
+	"""
+	cx, cy, a, b, theta, start, end = prims.T
+	dx = px - cx
+	dy = py - cy
+	c, s = np.cos(theta), np.sin(theta)
+	# rotate into the ellipse frame (cv2 rotates clockwise with y pointing down)
+	u = (dx*c + dy*s) / np.maximum(a, 0.5)
+	v = (dy*c - dx*s) / np.maximum(b, 0.5)
+	inside = u*u + v*v <= 1.0
+	# parametric angle of the point, checked against the drawn arc
+	t = np.degrees(np.arctan2(v, u))
+	span = end - start
+	return inside & ((span >= 360) | ((t - start) % 360 <= span))
+
+
+def _candidatePairs(boxes, cell_size):
+	"""
+	Vectorised uniform grid broad phase, returns index arrays (i, j) with j < i
+	of all boxes (x0, y0, x1, y1) that overlap
+	"""
+	N = len(boxes)
+	if N < 2:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	c = max(int(cell_size), 1)
+	cx0 = np.floor_divide(boxes[:, 0], c).astype(np.int64)
+	cy0 = np.floor_divide(boxes[:, 1], c).astype(np.int64)
+	cx1 = np.floor_divide(np.ceil(boxes[:, 2]) - 1, c).astype(np.int64)
+	cy1 = np.floor_divide(np.ceil(boxes[:, 3]) - 1, c).astype(np.int64)
+	nx = cx1 - cx0 + 1
+	k = nx * (cy1 - cy0 + 1)
+	# one (cell, owner) entry for every cell a box spans
+	owner = np.repeat(np.arange(N), k)
+	local = np.arange(k.sum()) - np.repeat(np.cumsum(k) - k, k)
+	cx = np.repeat(cx0, k) + local % np.repeat(nx, k)
+	cy = np.repeat(cy0, k) + local // np.repeat(nx, k)
+	cell = (cx - cx.min()) * (cy.max() - cy.min() + 1) + (cy - cy.min())
+	order = np.lexsort((owner, cell))
+	cell = cell[order]
+	owner = owner[order]
+	# pair every entry with the entries before it in the same cell
+	starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+	group_start = np.repeat(starts, np.diff(np.r_[starts, len(cell)]))
+	count = np.arange(len(cell)) - group_start
+	i = np.repeat(owner, count)
+	j = owner[np.repeat(group_start, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)]
+	pair = np.unique(i * N + j)
+	i, j = pair // N, pair % N
+	keep = (boxes[i, 0] < boxes[j, 2]) & (boxes[j, 0] < boxes[i, 2]) & (boxes[i, 1] < boxes[j, 3]) & (boxes[j, 1] < boxes[i, 3])
+	return i[keep], j[keep]
+
+
+def findCollisionsAnalytic(table, imgh, imgw, cell_size):
+	"""
+	Same rule as findCollisions, evaluated geometrically from the drops' shape
+	primitives instead of their label sprites, vectorised over candidate pairs:
+	a drop collides when its center lies inside an earlier drop's footprint and
+	then merges with every earlier drop whose primitives' boxes reach its box
+	"""
+	if len(table) < 2:
+		table.setCollisions([], [])
+		return 0
+	boxes = table.boxes().astype(np.float64)
+	owner, prims = _dropPrimitives(table, boxes)
+	# drop pairs sharing a grid cell, then expanded to every primitive of the earlier drop
+	i, j = _candidatePairs(boxes, cell_size)
+	first = np.searchsorted(owner, np.arange(len(table)))
+	nprims = np.bincount(owner, minlength=len(table))
+	per_pair = nprims[j]
+	pair_id = np.repeat(np.arange(len(i)), per_pair)
+	p = np.repeat(first[j], per_pair) + np.arange(per_pair.sum()) - np.repeat(np.cumsum(per_pair) - per_pair, per_pair)
+	inside = _insidePrimitives(table.x[i[pair_id]], table.y[i[pair_id]], prims[p])
+	covers = np.bincount(pair_id, weights=inside, minlength=len(i)) > 0
+	# earlier drops reaching into the (image clipped) box of the later one
+	clip = clipBoxes(boxes, imgh, imgw)[0]
+	pbox = _primitiveBoxes(prims[p])
+	b = clip[i[pair_id]]
+	reach = (pbox[:, 0] < b[:, 2]) & (b[:, 0] < pbox[:, 2]) & (pbox[:, 1] < b[:, 3]) & (b[:, 1] < pbox[:, 3])
+	touches = np.bincount(pair_id, weights=reach, minlength=len(i)) > 0
+
+	colliding = np.zeros(len(table), dtype=bool)
+	colliding[i[covers]] = True
+	mask = touches & colliding[i]
+	order = np.lexsort((j[mask], i[mask]))
+	table.setCollisions(i[mask][order], j[mask][order])
+	return int(table.colli.sum())
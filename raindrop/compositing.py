@@ -0,0 +1,163 @@
+import cv2
+import numpy as np
+
+from .collision import SpatialHash
+from .config import RENDER_DEFAULTS
+from .droptable import clipBoxes
+from .raindrop import blurBackground, refract
+"""
+Blend rendered drops onto the frame with plain array arithmetic
+
+"""
+
+
+def compositeDrop(frame, x, y, texture, alpha, edge_ratio):
+	"""
+	Blend one drop into frame (HxWx3 uint8, updated in place) with its top left at (x, y)
+	texture is the HxWx4 uint8 RGBA drop and alpha the HxW accumulated alpha map (0-255)
+	under it. Same as pasting the texture darkened by edge_ratio through
+	alpha * texture alpha and then the texture through its own alpha, except
+	that it rounds once instead of after each paste (at most 3 grey levels
+	apart where drops overlap); parts falling outside the frame are clipped
+	"""
+	h, w = texture.shape[:2]
+	H, W = frame.shape[:2]
+	x0, y0 = max(x, 0), max(y, 0)
+	x1, y1 = min(x + w, W), min(y + h, H)
+	if x0 >= x1 or y0 >= y1:
+		return frame
+	tex = texture[y0 - y:y1 - y, x0 - x:x1 - x]
+	# per pixel weights are built in 2D and widened with cv2.merge, numpy
+	# broadcasting over a trailing channel axis is several times slower
+	tex_alpha = cv2.extractChannel(tex, 3).astype(np.float32) * (1/255)
+	# edge layer weight, truncated to 8 bit like the mask image it replaces
+	edge_alpha = np.floor(alpha[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.float32) * tex_alpha) * (1/255)
+	keep = 1 - tex_alpha
+	rgb = cv2.cvtColor(tex, cv2.COLOR_RGBA2RGB).astype(np.float32)
+
+	roi = frame[y0:y1, x0:x1]
+	out = roi.astype(np.float32)
+	out *= cv2.merge(((1 - edge_alpha) * keep,) * 3)
+	# brightness enhancement truncates as well
+	out += np.floor(rgb * edge_ratio) * cv2.merge((edge_alpha * keep,) * 3)
+	out += rgb * cv2.merge((tex_alpha,) * 3)
+	out += 0.5
+	roi[...] = out.astype(np.uint8)
+	return frame
+
+
+class SparseAlphaMap():
+	"""
+	Sum of the drop alpha sprites over the frame, kept as the clipped sprites
+	themselves, overlaps are only added up for the regions that are asked for
+	"""
+	def __init__(self, imgh, imgw, cell_size):
+		self.imgh = imgh
+		self.imgw = imgw
+		self.index = SpatialHash(cell_size)
+		self.sprites = []
+		self._regions = {}
+
+	def add(self, x, y, alpha):
+		"""
+		Add an alpha sprite with its top left at (x, y), parts outside the frame are dropped
+		"""
+		h, w = alpha.shape
+		box = self._clip((x, y, x + w, y + h))
+		self.addClipped(box, alpha[max(box[1] - y, 0):box[3] - y, max(box[0] - x, 0):box[2] - x])
+
+	def addClipped(self, box, alpha):
+		"""
+		Add an alpha sprite already cropped to box, its part inside the frame
+		"""
+		box = tuple(int(v) for v in box)
+		if box[0] >= box[2] or box[1] >= box[3]:
+			return
+		n = len(self.sprites)
+		self.sprites.append((box, alpha))
+		self.index.insert(n, box)
+
+	def _clip(self, box):
+		return (max(box[0], 0), max(box[1], 0), min(box[2], self.imgw), min(box[3], self.imgh))
+
+	def region(self, box):
+		"""
+		Accumulated alpha (float32) over box = (x0, y0, x1, y1), clipped to the frame
+		"""
+		box = self._clip(box)
+		if box in self._regions:
+			return self._regions[box]
+		L, U, R, D = box
+		out = np.zeros((max(D - U, 0), max(R - L, 0)), dtype=np.float32)
+		for n in self.index.query(box):
+			(x0, y0, x1, y1), alpha = self.sprites[n]
+			l, u, r, d = max(L, x0), max(U, y0), min(R, x1), min(D, y1)
+			out[u - U:d - U, l - L:r - L] += alpha[u - y0:d - y0, l - x0:r - x0]
+		return out
+
+	def max(self):
+		"""
+		Global maximum, every covered pixel lies in some sprite box so their maxima suffice
+		the per box sums are kept, drops usually ask for their own box again
+		"""
+		peak = 0.0
+		for box, _ in self.sprites:
+			region = self.region(box)
+			self._regions[box] = region
+			peak = max(peak, float(region.max()))
+		return peak
+
+	def label(self):
+		"""
+		Dense uint8 frame, 1 wherever any sprite has alpha
+		"""
+		label = np.zeros((self.imgh, self.imgw), dtype=np.uint8)
+		for (x0, y0, x1, y1), alpha in self.sprites:
+			label[y0:y1, x0:x1] |= alpha > 0
+		return label
+
+
+def compositeDrops(image, table, cfg, return_label = False):
+	"""
+	Render the drops of a DropTable onto an HxWx3 uint8 image drop by drop, in
+	table order (later drops on top); the one-shot path, cheaper than baking a
+	LensLayer when the drops are applied to a single image
+	returns the rainy image and, with return_label, the uint8 0/1 drop mask
+	"""
+	imgh, imgw = image.shape[:2]
+	edge_ratio = cfg["edge_darkratio"]
+	distortion = cfg.get("distortion_coeffs", RENDER_DEFAULTS["distortion_coeffs"])
+	maxR = int(table.radius.max()) if len(table) else 1
+
+	# visible part of every drop, in frame (dst) and sprite (src) coordinates
+	dst, src = clipBoxes(table.boxes(), imgh, imgw)
+	visible = np.flatnonzero((dst[:, 0] < dst[:, 2]) & (dst[:, 1] < dst[:, 3]))
+
+	# add alpha for the edge of the drops, only over the drop boxes
+	alpha_map = SparseAlphaMap(imgh, imgw, 5*maxR)
+	for row in visible:
+		sx0, sy0, sx1, sy1 = src[row]
+		alpha_map.addClipped(dst[row], table.alphaMap(row)[sy0:sy1, sx0:sx1])
+	alpha_peak = alpha_map.max()
+	alpha_scale = 255.0/alpha_peak if alpha_peak > 0 else 0.0
+
+	output = np.array(image)
+	if len(visible):
+		# blur the whole background once, every drop refracts a view of it
+		blurred = blurBackground(image)
+	for row in visible:
+		L, U, R, D = dst[row].tolist()
+		sx0, sy0, sx1, sy1 = src[row].tolist()
+		alphamap = table.alphaMap(row)
+		h, w = alphamap.shape
+		tmp_bg = blurred[U:D, L:R]
+		# drops over the border refract the frame edge extended to the full
+		# sprite, only the part inside the frame is kept
+		if (sx0, sy0, sx1, sy1) != (0, 0, w, h):
+			tmp_bg = cv2.copyMakeBorder(tmp_bg, sy0, h - sy1, sx0, w - sx1, cv2.BORDER_REPLICATE)
+		texture = refract(tmp_bg, int(table.radius[row]), alphamap, distortion, blurred = True)
+		compositeDrop(output, L, U, texture[sy0:sy1, sx0:sx1], alpha_map.region((L, U, R, D)) * alpha_scale, edge_ratio)
+
+	if return_label:
+		return output, alpha_map.label()
+	return output
@@ -7,5 +7,28 @@ cfg = {
 	'return_label': False,
 	'label_thres': 128,
 	'shape_variety': True,  # Enable random droplet shapes
-	'allowed_shapes': ["default", "round", "oval", "teardrop", "irregular", "splash"]  # Available shapes
-}
\ No newline at end of file
+	'allowed_shapes': ["default", "round", "oval", "teardrop", "irregular", "splash"],  # Available shapes
+	'distortion_coeffs': [0.0, 0.0, 0.0, 0.0],  # Fisheye k1..k4 of the drop lens
+	'max_merge_passes': 8,  # Upper bound on collision/merge passes
+	'collision_mode': "raster",  # "raster" sprite tests or "analytic" shape geometry
+	'placement': "uniform",  # "uniform" then merge overlaps, or "poisson" collision free
+	'image_format': None,  # None keeps the input extension, or "jpeg", "png", "webp"
+	'jpeg_quality': 75,
+	'jpeg_subsampling': "4:2:0",  # "4:4:4", "4:2:2" or "4:2:0"
+	'png_compression': 6,  # zlib level 0-9
+	'webp_quality': 90,
+	'webp_lossless': False,
+	'label_format': None  # None keeps the input extension (0/255), or "png", "png1" 1 bit, "npy" packed bits
+}
+
+# what the renderer uses for optional entries a cfg leaves out, read by
+# layoutDrops and compositing and filled in by normalizeCfg, so an indexed
+# or cached config renders like the cfg it came from
+RENDER_DEFAULTS = {
+	'shape_variety': False,
+	'allowed_shapes': ["default"],
+	'distortion_coeffs': None,
+	'max_merge_passes': 8,
+	'collision_mode': "raster",
+	'placement': "uniform",
+}
@@ -1,110 +1,140 @@
-import random
-from random import randint
-import cv2
-import math
+import io
 import numpy as np
-from PIL import Image, ImageFilter
-from PIL import ImageEnhance
+from PIL import Image
 from skimage.measure import label as skimage_label
 
-from .raindrop import raindrop
+from .raindrop import sampleSprite, mergeSprites
+from .droptable import DropTable, Sprite, SHAPES
+from .lens import LensLayer
+from .compositing import compositeDrops
+from .config import RENDER_DEFAULTS
+from .rng import makeRng, randint, choice
+from .placement import samplePoissonDisk
+from .collision import SpatialHash, UnionFind, findCollisions, findCollisionsAnalytic
 """
 This script generate the Drop on the images
 Author: Chia-Tse, Chang
 
 """
 
+# bumped whenever the same (image, cfg, seed) renders different pixels,
+# stored alongside seeds so outputs derived from them can be told apart
+RENDER_VERSION = 2
 
-def CheckCollision(DropList):
+
+def CheckCollision(table):
 	"""
 	This function handle the collision of the drops
+	every group of transitively colliding drops is merged into one drop, centered
+	on the radius weighted mean of the members and with their summed area, whose
+	sprite combines the members' sprites (see mergeSprites)
+	returns a new DropTable, groups keep the position of their first member
 	"""
-	
-	listFinalDrops = []
-	Checked_list = []
-	list_len = len(DropList)
-	# because latter raindrops in raindrop list should has more colision information
-	# so reverse list	
-	DropList.reverse()
-	drop_key = 1
-	for drop in DropList:
-		# if the drop has not been handle	
-		if drop.getKey() not in Checked_list:			
-			# if drop has collision with other drops
-			if drop.getIfColli():
-				# get collision list
-				collision_list = drop.getCollisionList()
-				# first get radius and center to decide how  will the collision do
-				final_x = drop.getCenters()[0] * drop.getRadius()
-				final_y = drop.getCenters()[1]  * drop.getRadius()
-				tmp_devide = drop.getRadius()
-				final_R = drop.getRadius()  * drop.getRadius()
-				for col_id in collision_list:				
-					Checked_list.append(col_id)
-					# list start from 0				
-					final_x += DropList[list_len - col_id].getRadius() * DropList[list_len - col_id].getCenters()[0]
-					final_y += DropList[list_len - col_id].getRadius() * DropList[list_len - col_id].getCenters()[1]
-					tmp_devide += DropList[list_len - col_id].getRadius()
-					final_R += DropList[list_len - col_id].getRadius() * DropList[list_len - col_id].getRadius() 
-				final_x = int(round(final_x/tmp_devide))
-				final_y = int(round(final_y/tmp_devide))
-				final_R = int(round(math.sqrt(final_R)))
-				# rebuild drop after handled the collisions
-				newDrop = raindrop(drop_key, (final_x, final_y), final_R)
-				drop_key = drop_key+1
-				listFinalDrops.append(newDrop)
-			# no collision
-			else:
-				drop.setKey(drop_key)
-				drop_key = drop_key+1
-				listFinalDrops.append(drop)			
-	
+	groups = UnionFind(len(table))
+	for n, m in zip(table.col_rows.tolist(), table.col_with.tolist()):
+		groups.union(n, m)
+	members = groups.groups()
+	group_of = np.empty(len(table), dtype=np.int64)
+	for g, rows in enumerate(members):
+		group_of[rows] = g
+	first = np.array([rows[0] for rows in members], dtype=np.int64)
+	size = np.bincount(group_of)
+
+	# radius weighted centers and area preserving radii of all groups at once
+	radius = table.radius.astype(np.float64)
+	tmp_devide = np.bincount(group_of, weights=radius)
+	final_x = np.round(np.bincount(group_of, weights=radius * table.x) / tmp_devide).astype(np.int64)
+	final_y = np.round(np.bincount(group_of, weights=radius * table.y) / tmp_devide).astype(np.int64)
+	final_R = np.round(np.sqrt(np.bincount(group_of, weights=radius * radius))).astype(np.int64)
+
+	merged = size > 1
+	x = np.where(merged, final_x, table.x[first])
+	y = np.where(merged, final_y, table.y[first])
+	R = np.where(merged, final_R, table.radius[first])
+	sprite = table.sprite[first].copy()
+	shape = table.shape[first].copy()
+	ident = table.ident[first].copy()
+	sprites = list(table.sprites)
+	# merged drops are built from the sprites of their members
+	for g in np.flatnonzero(merged):
+		rows = members[g]
+		new_sprite = mergeSprites([table.sprites[table.sprite[m]] for m in rows], [(int(table.x[m]), int(table.y[m])) for m in rows], table.radius[rows], (int(x[g]), int(y[g])))
+		sprite[g] = len(sprites)
+		shape[g] = SHAPES.index(new_sprite.kind) if new_sprite.kind in SHAPES else -1
+		sprites.append(new_sprite)
+	ident[merged] = table.next_ident + np.arange(merged.sum())
+	return DropTable(x, y, R, sprite, sprites, shape = shape, use_label = table.use_label[first], ident = ident, next_ident = table.next_ident + int(merged.sum()))
+
+
+def _decodeImage(image):
+	"""
+	Turn an ndarray, PIL.Image or encoded bytes into an HxWx3 uint8 array,
+	decoding at most once and never touching the filesystem
+	"""
+	if isinstance(image, (bytes, bytearray, memoryview)):
+		image = Image.open(io.BytesIO(image))
+	if isinstance(image, Image.Image):
+		if image.mode != 'RGB':
+			image = image.convert('RGB')
+		return np.asarray(image)
+	if isinstance(image, np.ndarray):
+		if image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+			raise ValueError("expected an HxWx3 uint8 array, got shape %s dtype %s" % (image.shape, image.dtype))
+		return image
+	raise TypeError("unsupported image type: %s" % type(image).__name__)
+
+
+def generateDrops(imagePath, cfg, inputLabel = None, rng = None):
+	"""
+	This function generate the drop with random position
+	rng is a numpy Generator or seed (see makeRng) every random draw comes from
+	"""
+	return generateDropsFromImage(Image.open(imagePath), cfg, inputLabel, rng = rng)
+
 
-	return listFinalDrops
+def generateLensLayer(imgh, imgw, cfg, inputLabel = None, rng = None):
+	"""
+	Place the drops of an imgh x imgw frame, resolve their collisions and bake
+	them into a LensLayer, which rains on any image of that size
+	"""
+	return LensLayer.fromTable(layoutDrops(imgh, imgw, cfg, inputLabel, rng), imgh, imgw, cfg)
 
 
-def generateDrops(imagePath, cfg, inputLabel = None):
+def layoutDrops(imgh, imgw, cfg, inputLabel = None, rng = None):
 	"""
-	This function generate the drop with random position
+	Place the drops of an imgh x imgw frame and resolve their collisions
+	returns the final DropTable, the only random part of a render, drawn from
+	rng (a numpy Generator or seed, see makeRng)
 	"""
-	
+	rng = makeRng(rng)
 	maxDrop = cfg["maxDrops"]
 	minDrop = cfg["minDrops"]
-	drop_num = randint(minDrop, maxDrop)
+	drop_num = randint(rng, minDrop, maxDrop)
 	maxR = cfg["maxR"]
 	minR = cfg["minR"]
-	ifReturnLabel = cfg["return_label"]
-	edge_ratio = cfg["edge_darkratio"]
-
-	PIL_bg_img = Image.open(imagePath)
-	bg_img = np.asarray(PIL_bg_img)
-	# to check if collision or not
-	label_map = np.zeros_like(bg_img)[:,:,0]
-	imgh, imgw, _ = bg_img.shape
-	
 	
-	# random drops position
-	ran_pos = [(int(random.random() * imgw), int(random.random() * imgh)) for _ in range(drop_num)]
-
-	listRainDrops = []
 	#########################
 	# Create Raindrop
 	#########################
 	# create raindrop by default
 	if inputLabel is None:
-		for key, pos in enumerate(ran_pos):
-			# label should start from 1
-			key = key+1
-			radius = random.randint(minR, maxR)
-			
+		radii = rng.integers(minR, maxR, size=drop_num, endpoint=True).tolist()
+		if cfg.get("placement", RENDER_DEFAULTS["placement"]) == "poisson":
+			# collision free centers for the radii
+			ran_pos = samplePoissonDisk(radii, imgw, imgh, rng = rng)
+		else:
+			# random drops position, overlaps are merged below
+			ran_pos = (rng.random((drop_num, 2)) * (imgw, imgh)).astype(np.int64)
+		sprites = []
+		for key in range(drop_num):
 			# Determine droplet type based on configuration
 			droplet_type = None
-			if cfg.get('shape_variety', False):
-				allowed_shapes = cfg.get('allowed_shapes', ["default"])
-				droplet_type = random.choice(allowed_shapes)
+			if cfg.get('shape_variety', RENDER_DEFAULTS['shape_variety']):
+				allowed_shapes = cfg.get('allowed_shapes', RENDER_DEFAULTS['allowed_shapes'])
+				droplet_type = choice(rng, allowed_shapes)
 			
-			drop = raindrop(key, pos, radius, droplet_type=droplet_type)
-			listRainDrops.append(drop)
+			sprites.append(sampleSprite(radii[key], droplet_type, rng))
+		table = DropTable.fromDrops(ran_pos, radii, sprites)
 	#using input label			
 	else:
 		arrayLabel = np.asarray(inputLabel)
@@ -113,6 +143,9 @@ def generateDrops(imagePath, cfg, inputLabel = None):
 		label = np.where(condition, 1, 0)
 
 		label_part, label_nums = skimage_label(label, connectivity=2, return_num = True)		
+		centers = []
+		radii = []
+		sprites = []
 		for idx in range(label_nums):
 			# 0 is bg
 			i = idx+1
@@ -122,193 +155,70 @@ def generateDrops(imagePath, cfg, inputLabel = None):
 			L = np.min(label_index[:,1])
 			R = np.max(label_index[:,1]) + 1
 			cur_alpha = arrayLabel[U:D, L:R, 0].copy()
-			#cur_alpha[(cur_alpha<=cfg["label_thres"])] = 0
 			
-			cur_label = (cur_alpha>cfg["label_thres"]) * 1	
+			cur_label = cur_alpha>cfg["label_thres"]
 			
 			# store left top
-			centerxy = (L, U)			
-			drop = raindrop(idx, centerxy = centerxy, input_alpha = cur_alpha, input_label = cur_label)
-			listRainDrops.append(drop)
-			
-		
-			
-	
-	
-		
+			centers.append((L, U))
+			radii.append(min((R - L)//4, (D - U)//4))
+			sprites.append(Sprite("label", (), cur_label, cur_alpha, (0, 0)))
+		table = DropTable.fromDrops(centers, radii, sprites, use_label = True)
 			
 	#########################
 	# Handle Collision
 	#########################
 	
-	collisionNum = len(listRainDrops)
-	listFinalDrops = list(listRainDrops)
-	loop = 0
-	
 	# only check when using default raindrop
 	if inputLabel is None:
-		while collisionNum > 0:		
-			loop = loop+1
-			listFinalDrops = list(listFinalDrops)
-			collisionNum = len(listFinalDrops)
-			label_map = np.zeros_like(label_map)
-			# Check Collision
-			for drop in listFinalDrops:		
-				# check the bounding 
-				(ix, iy) = drop.getCenters()
-				radius = drop.getRadius()
-				ROI_WL = 2*radius
-				ROI_WR = 2*radius
-				ROI_HU = 3*radius
-				ROI_HD = 2*radius
-				if (iy-3*radius) <0 :
-					ROI_HU = iy	
-				if (iy+2*radius)>imgh:
-					ROI_HD = imgh - iy
-				if (ix-2*radius)<0:
-					ROI_WL = ix			
-				if  (ix+2*radius) > imgw:
-					ROI_WR = imgw - ix
-
-				# apply raindrop label map to Image's label map
-				drop_label = drop.getLabelMap()
-
-
-				# check if center has already has drops
-				if (label_map[iy, ix] > 0):
-					col_ids = np.unique(label_map[iy - ROI_HU:iy + ROI_HD, ix - ROI_WL: ix+ROI_WR])
-					col_ids = col_ids[col_ids!=0]
-					drop.setCollision(True, col_ids)
-					label_map[iy - ROI_HU:iy + ROI_HD, ix - ROI_WL: ix+ROI_WR] = drop_label[3*radius - ROI_HU:3*radius + ROI_HD, 2*radius - ROI_WL: 2*radius+ROI_WR] * drop.getKey()
-				else:			
-					label_map[iy - ROI_HU:iy + ROI_HD, ix - ROI_WL: ix+ROI_WR] = drop_label[3*radius - ROI_HU:3*radius + ROI_HD, 2*radius - ROI_WL: 2*radius+ROI_WR] * drop.getKey()
-					# no collision 
-					collisionNum = collisionNum-1
-
-
-			if collisionNum > 0:
-				listFinalDrops = CheckCollision(listFinalDrops)	
-			
-
-	
-	# add alpha for the edge of the drops
-	alpha_map = np.zeros_like(label_map).astype(np.float64)
-	
-	if inputLabel is None:
-		for drop in listFinalDrops:
-			(ix, iy) = drop.getCenters()
-			radius = drop.getRadius()
-			ROI_WL = 2*radius
-			ROI_WR = 2*radius
-			ROI_HU = 3*radius
-			ROI_HD = 2*radius
-			if (iy-3*radius) <0 :
-				ROI_HU = iy	
-			if (iy+2*radius)>imgh:
-				ROI_HD = imgh - iy
-			if (ix-2*radius)<0:
-				ROI_WL = ix			
-			if  (ix+2*radius) > imgw:
-				ROI_WR = imgw - ix
-
-			drop_alpha = drop.getAlphaMap()	
-
-			alpha_map[iy - ROI_HU:iy + ROI_HD, ix - ROI_WL: ix+ROI_WR] += drop_alpha[3*radius - ROI_HU:3*radius + ROI_HD, 2*radius - ROI_WL: 2*radius+ROI_WR]
-			
-	else:
-		for drop in listFinalDrops:
-			(ix, iy) = drop.getCenters()
-			drop_alpha = drop.getAlphaMap()
-
-			h, w = drop_alpha.shape
-
-			alpha_map[iy:iy + h, ix: ix+w] += drop_alpha[:h, : w]
-		# alpha_map = arrayLabel[:,:,0].copy()			
-		'''
-		# Note: Commented out pyblur usage - replaced in individual raindrop processing
-		# alpha_map = pyblur.GaussianBlur(Image.fromarray(np.uint8(alpha_map)), 10)
-		# alpha_map = np.asarray(alpha_map).astype(np.float)
-		# alpha_map = alpha_map/np.max(alpha_map)*255.0
-		'''
-	alpha_map = alpha_map/np.max(alpha_map)*255.0
-	# alpha_map[label<1] = 0									
-
-	
-	
-
-
-	PIL_bg_img = Image.open(imagePath)
-	for drop in listFinalDrops:
-		# check bounding
-		if inputLabel is None:
-			(ix, iy) = drop.getCenters()
-			radius = drop.getRadius()		
-			ROIU = iy - 3*radius
-			ROID = iy + 2*radius
-			ROIL = ix - 2*radius
-			ROIR = ix + 2*radius
-			if (iy-3*radius) <0 :
-				ROIU = 0
-				ROID = 5*radius		
-			if (iy+2*radius)>imgh:
-				ROIU = imgh - 5*radius
-				ROID = imgh
-			if (ix-2*radius)<0:
-				ROIL = 0
-				ROIR = 4*radius
-			if  (ix+2*radius) > imgw:		
-				ROIL = imgw - 4*radius
-				ROIR = imgw
-		else:
-			# left top 
-			(ix, iy) = drop.getCenters()
-			h, w = drop.getLabelMap().shape			
-			ROIU = iy
-			ROID = iy + h 
-			ROIL = ix
-			ROIR = ix + w 
-
-
-		tmp_bg = bg_img[ROIU:ROID, ROIL:ROIR,:]
-		drop.updateTexture(tmp_bg)
-		tmp_alpha_map  = alpha_map[ROIU:ROID, ROIL:ROIR]
-		
-		
-		
-		
-		output = drop.getTexture()		
-		tmp_output = np.asarray(output).astype(np.float64)[:,:,-1]
-  
-		target_height, target_width = tmp_output.shape
-		
-
-		if tmp_alpha_map.shape != (target_height, target_width):
-			tmp_alpha_map = cv2.resize(tmp_alpha_map, (target_width, target_height), interpolation=cv2.INTER_LINEAR)
-		
-		tmp_alpha_map = tmp_alpha_map * (tmp_output/255)
-		tmp_alpha_map  = Image.fromarray(tmp_alpha_map.astype('uint8'))
-		
-		
-		edge = ImageEnhance.Brightness(output)
-		edge = edge.enhance(edge_ratio)
-		
-		
-		
-		if inputLabel is None:
-			PIL_bg_img.paste(edge, (ix-2*radius, iy-3*radius), tmp_alpha_map)
-			PIL_bg_img.paste(output, (ix-2*radius, iy-3*radius), output)
-		else:
-			PIL_bg_img.paste(edge, (ix, iy), tmp_alpha_map)
-			PIL_bg_img.paste(output, (ix, iy), output)
-		
-	
-
-	
-	if ifReturnLabel:
-		output_label = np.array(alpha_map)
-		output_label.flags.writeable = True
-		output_label[output_label>0] = 1
-		output_label = Image.fromarray(output_label.astype('uint8'))	
-		return PIL_bg_img, output_label
-
-	return PIL_bg_img
\ No newline at end of file
+		# grid cells about one sprite wide, so a drop spans only a few cells
+		cell_size = 5*maxR
+		analytic = cfg.get("collision_mode", RENDER_DEFAULTS["collision_mode"]) == "analytic"
+		if not analytic:
+			index = SpatialHash(cell_size)
+			for ident, box in zip(table.ident.tolist(), table.boxes().tolist()):
+				index.insert(ident, tuple(box))
+		dirty = None
+		# merged drops grow and may reach new drops, so repeat a bounded number of times
+		for loop in range(cfg.get("max_merge_passes", RENDER_DEFAULTS["max_merge_passes"])):
+			if analytic:
+				collisionNum = findCollisionsAnalytic(table, imgh, imgw, cell_size)
+			else:
+				collisionNum = findCollisions(table, index, imgh, imgw, dirty)
+			if collisionNum == 0:
+				break
+			merged = CheckCollision(table)
+			if not analytic:
+				# update the index with the merge results only
+				for ident in np.setdiff1d(table.ident, merged.ident).tolist():
+					index.remove(ident)
+				dirty = np.flatnonzero(~np.isin(merged.ident, table.ident))
+				boxes = merged.boxes()
+				for row in dirty.tolist():
+					index.insert(int(merged.ident[row]), tuple(boxes[row].tolist()))
+			table = merged
+
+	return table
+
+
+def generateDropsFromImage(image, cfg, inputLabel = None, as_array = False, rng = None):
+	"""
+	This function generate the drop on an in-memory image
+	image can be an HxWx3 uint8 ndarray, a PIL.Image or encoded image bytes
+	as_array returns uint8 ndarrays instead of PIL images
+	rng is a numpy Generator or seed (see makeRng), equal seeds give equal renders
+	"""
+	bg_img = _decodeImage(image)
+	imgh, imgw, _ = bg_img.shape
+	table = layoutDrops(imgh, imgw, cfg, inputLabel, rng)
+	# one image, compositing drop by drop is cheaper than baking a LensLayer
+	output = compositeDrops(bg_img, table, cfg, cfg["return_label"])
+
+	if cfg["return_label"]:
+		output_img, output_label = output
+		if as_array:
+			return output_img, output_label
+		return Image.fromarray(output_img), Image.fromarray(output_label)
+
+	if as_array:
+		return output
+	return Image.fromarray(output)
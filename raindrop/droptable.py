@@ -0,0 +1,126 @@
+from collections import namedtuple
+import numpy as np
+"""
+Struct of arrays representation of the drops of one image
+
+"""
+
+SHAPES = ["default", "round", "oval", "teardrop", "irregular", "splash"]
+
+# kind is the droplet type, shapes the integer draw primitives the label and
+# alpha arrays were rasterised from (empty for drops read from an input label),
+# origin the (x, y) of the drop center inside the sprite and parts the recipe
+# that rebuilds it, (radius, shapes, blur radius, dx, dy) per rasterised sprite
+# placed at (dx, dy); empty when the arrays cannot be rebuilt (input labels)
+Sprite = namedtuple("Sprite", ["kind", "shapes", "label", "alpha", "origin", "parts"], defaults=((),))
+
+
+def clipBoxes(boxes, imgh, imgw):
+	"""
+	Clip Nx4 sprite boxes (x0, y0, x1, y1) to an imgh x imgw frame in one go
+	returns dst, the visible part of every box in frame coordinates, and src,
+	the same part in sprite coordinates; empty boxes have x0 >= x1 or y0 >= y1
+	"""
+	boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+	dst = np.clip(boxes, 0, [imgw, imgh, imgw, imgh])
+	src = dst - boxes[:, [0, 1, 0, 1]]
+	return dst, src
+
+
+class DropTable():
+	"""
+	One row per drop, every column a NumPy array:
+	x / y       center (top left for drops read from an input label)
+	radius      drop radius
+	shape       index into SHAPES, -1 for input label drops
+	key         1 based drop key
+	sprite      index into sprites, drops share sprites rather than own them
+	use_label   drop comes from an input label
+	colli       drop collided in the last collision pass
+	ident       stable id of the drop, kept while it is not merged
+	col_rows / col_with   (row, earlier row) collision pairs of the last pass
+	"""
+	def __init__(self, x, y, radius, sprite, sprites, shape = None, key = None, use_label = None, ident = None, next_ident = None):
+		n = len(x)
+		self.x = np.asarray(x, dtype=np.int64).reshape(n)
+		self.y = np.asarray(y, dtype=np.int64).reshape(n)
+		self.radius = np.asarray(radius, dtype=np.int64).reshape(n)
+		self.sprite = np.asarray(sprite, dtype=np.int64).reshape(n)
+		self.sprites = sprites
+		if shape is None:
+			shape = [SHAPES.index(sprites[s].kind) if sprites[s].kind in SHAPES else -1 for s in self.sprite]
+		self.shape = np.asarray(shape, dtype=np.int8).reshape(n)
+		self.key = np.arange(1, n + 1) if key is None else np.asarray(key, dtype=np.int64).reshape(n)
+		self.use_label = np.zeros(n, dtype=bool) if use_label is None else np.asarray(use_label, dtype=bool).reshape(n)
+		self.ident = np.arange(n) if ident is None else np.asarray(ident, dtype=np.int64).reshape(n)
+		if next_ident is None:
+			next_ident = int(self.ident.max()) + 1 if n else 0
+		self.next_ident = next_ident
+		self.colli = np.zeros(n, dtype=bool)
+		self.col_rows = np.zeros(0, dtype=np.int64)
+		self.col_with = np.zeros(0, dtype=np.int64)
+
+	@classmethod
+	def fromDrops(cls, centers, radii, sprites, keys = None, use_label = False):
+		"""
+		Build a table from per drop centers, radii and Sprites, one sprite per drop
+		"""
+		centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+		n = len(centers)
+		return cls(centers[:, 0], centers[:, 1], radii, np.arange(n), list(sprites), key = keys, use_label = np.full(n, use_label))
+
+	def __len__(self):
+		return len(self.x)
+
+	def spriteSize(self):
+		"""
+		(height, width) of every row's sprite
+		"""
+		sizes = np.array([s.label.shape for s in self.sprites], dtype=np.int64).reshape(-1, 2)
+		return sizes[self.sprite]
+
+	def spriteOrigin(self):
+		"""
+		(x, y) of the drop center inside every row's sprite
+		"""
+		origins = np.array([s.origin for s in self.sprites], dtype=np.int64).reshape(-1, 2)
+		return origins[self.sprite]
+
+	def boxes(self):
+		"""
+		Unclipped sprite boxes (x0, y0, x1, y1) of all rows; generated drops
+		span 2R to either side, 3R above and 2R below their center
+		"""
+		size = self.spriteSize()
+		origin = self.spriteOrigin()
+		x0 = self.x - origin[:, 0]
+		y0 = self.y - origin[:, 1]
+		return np.stack((x0, y0, x0 + size[:, 1], y0 + size[:, 0]), axis=1)
+
+	def labelMap(self, row):
+		return self.sprites[self.sprite[row]].label
+
+	def alphaMap(self, row):
+		return self.sprites[self.sprite[row]].alpha
+
+	def shapes(self, row):
+		return self.sprites[self.sprite[row]].shapes
+
+	def setCollisions(self, rows, col_with):
+		"""
+		Record the collision pairs of a pass, rows[k] collided with the earlier row col_with[k]
+		"""
+		self.col_rows = np.asarray(rows, dtype=np.int64)
+		self.col_with = np.asarray(col_with, dtype=np.int64)
+		self.colli = np.zeros(len(self), dtype=bool)
+		self.colli[self.col_rows] = True
+
+	def drop(self, row):
+		"""
+		raindrop view over one row
+		"""
+		from .raindrop import raindrop
+		return raindrop.view(self, row)
+
+	def drops(self):
+		return [self.drop(row) for row in range(len(self))]
@@ -0,0 +1,172 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+"""
+Output writers for rendered images and labels, selected through cfg
+
+"""
+
+IMAGE_FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+LABEL_FORMATS = {"png": ".png", "png1": ".png", "npy": ".npy"}
+# cfg entries that only change how outputs are encoded, never the rendered pixels
+ENCODER_KEYS = ("image_format", "jpeg_quality", "jpeg_subsampling", "png_compression", "webp_quality", "webp_lossless", "label_format")
+
+
+def _extension(ext, fmt, formats):
+	if fmt is None:
+		return ext
+	if fmt not in formats:
+		raise ValueError(f"Unknown output format {fmt!r}, expected one of {sorted(formats)}")
+	return formats[fmt]
+
+
+def outputPath(path, fmt, formats):
+	"""
+	path with the extension of fmt, unchanged when fmt is None (keep the input's)
+	"""
+	root, ext = os.path.splitext(path)
+	return root + _extension(ext, fmt, formats)
+
+
+def _imageFormat(ext, cfg):
+	fmt = cfg.get("image_format")
+	if fmt is not None:
+		return fmt
+	ext = ext.lower()
+	return {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp"}.get(ext)
+
+
+def encodeImage(image, cfg, ext = ".jpg"):
+	"""
+	Encode an HxWx3 uint8 RGB image with the encoder settings of cfg
+	ext is the extension used when cfg["image_format"] is None
+	returns (extension, encoded bytes)
+	"""
+	ext = _extension(ext, cfg.get("image_format"), IMAGE_FORMATS)
+	fmt = _imageFormat(ext, cfg)
+	img = Image.fromarray(image)
+	buffer = io.BytesIO()
+	if fmt == "jpeg":
+		img.save(buffer, "JPEG", quality=cfg.get("jpeg_quality", 75), subsampling=cfg.get("jpeg_subsampling", "4:2:0"))
+	elif fmt == "png":
+		img.save(buffer, "PNG", compress_level=cfg.get("png_compression", 6))
+	elif fmt == "webp":
+		img.save(buffer, "WEBP", quality=cfg.get("webp_quality", 90), lossless=cfg.get("webp_lossless", False))
+	else:
+		# other extensions (.bmp, ...) with PIL defaults
+		img.save(buffer, Image.registered_extensions()[ext.lower()])
+	return ext, buffer.getvalue()
+
+
+def writeImage(path, image, cfg):
+	"""
+	Write an HxWx3 uint8 RGB image with the encoder settings of cfg
+	returns the path written, its extension follows cfg["image_format"]
+	"""
+	return writeEncoded(path, *encodeImage(image, cfg, os.path.splitext(path)[1]))
+
+
+def packLabel(label):
+	"""
+	Pack an HxW 0/1 label to HxceilW/8 bits, unpackLabel(packed, W) reverses it
+	"""
+	return np.packbits(label.astype(bool, copy=False), axis=1)
+
+
+def unpackLabel(packed, width):
+	return np.unpackbits(packed, axis=1, count=width)
+
+
+_scratch_local = threading.local()
+
+
+def _scratch(shape):
+	"""
+	uint8 buffer of shape owned by the calling thread, reused while the label size stays the same
+	"""
+	buffer = getattr(_scratch_local, "buffer", None)
+	if buffer is None or buffer.shape != shape:
+		buffer = _scratch_local.buffer = np.empty(shape, dtype=np.uint8)
+	return buffer
+
+
+def encodeLabel(label, cfg, ext = ".png"):
+	"""
+	Encode an HxW uint8 0/1 label with cfg["label_format"]:
+	None keeps ext as a 0/255 image, "png" a 0/255 8 bit PNG,
+	"png1" a 1 bit PNG and "npy" the bits packed along rows (see packLabel)
+	8 bit formats scale label to 0/255 into a per thread scratch buffer, label
+	itself is left untouched and may be read-only
+	returns (extension, encoded bytes)
+	"""
+	fmt = cfg.get("label_format")
+	ext = _extension(ext, fmt, LABEL_FORMATS)
+	if fmt == "npy":
+		buffer = io.BytesIO()
+		np.save(buffer, packLabel(label))
+		return ext, buffer.getvalue()
+	if fmt == "png1":
+		h, w = label.shape
+		buffer = io.BytesIO()
+		Image.frombytes("1", (w, h), packLabel(label).tobytes()).save(buffer, "PNG", compress_level=cfg.get("png_compression", 6))
+		return ext, buffer.getvalue()
+	# Multiply by 255 to make labels visible (0 -> 0, 1 -> 255)
+	scaled = np.multiply(label, np.uint8(255), out=_scratch(label.shape), casting="unsafe")
+	params = [cv2.IMWRITE_PNG_COMPRESSION, min(cfg.get("png_compression", 6), 9)] if ext.lower() == ".png" else []
+	ok, data = cv2.imencode(ext, scaled, params)
+	if not ok:
+		raise ValueError(f"Could not encode label as {ext}")
+	return ext, data.tobytes()
+
+
+def writeLabel(path, label, cfg):
+	"""
+	Write an HxW uint8 0/1 label with cfg["label_format"], see encodeLabel
+	returns the path written
+	"""
+	return writeEncoded(path, *encodeLabel(label, cfg, os.path.splitext(path)[1]))
+
+
+def writeEncoded(path, ext, data):
+	"""
+	Write already encoded bytes to path with its extension replaced by ext
+	returns the path written
+	"""
+	path = os.path.splitext(path)[0] + ext
+	with open(path, "wb") as f:
+		f.write(data)
+	return path
+
+
+class BackgroundWriter():
+	"""
+	Thread pool for output writes with a bound on the writes in flight,
+	submit blocks once max_pending writes are queued so memory stays bounded
+	"""
+	def __init__(self, threads = 2, max_pending = 8):
+		self._pool = ThreadPoolExecutor(max_workers=threads)
+		self._slots = threading.BoundedSemaphore(max_pending)
+
+	def submit(self, fn, *args):
+		self._slots.acquire()
+		try:
+			future = self._pool.submit(fn, *args)
+		except Exception:
+			self._slots.release()
+			raise
+		future.add_done_callback(lambda _: self._slots.release())
+		return future
+
+	def close(self):
+		self._pool.shutdown(wait=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
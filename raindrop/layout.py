@@ -0,0 +1,141 @@
+import json
+
+import numpy as np
+
+from .droptable import DropTable, Sprite
+from .raindrop import buildSprite
+from .lens import LensLayer
+from .compositing import compositeDrops
+"""
+Drop layouts, the sampled drops of a frame saved and replayed without placing them again
+
+"""
+
+LAYOUT_VERSION = 1
+
+
+def _tupled(value):
+	# JSON turns the nested shape tuples into lists, sprite_cache keys need tuples
+	if isinstance(value, list):
+		return tuple(_tupled(v) for v in value)
+	return value
+
+
+class DropLayout():
+	"""
+	The drops of one frame after placement and collision resolution:
+	x / y, radius, key and use_label per drop (as in DropTable) and the Sprites
+	they point into, each saved as its recipe (kind, origin, size, parts) so it
+	is rasterised again on load; sprites read from an input label have no recipe
+	and keep their label / alpha arrays
+	width / height is the frame the layout was sampled for, positions are pixels
+	"""
+	def __init__(self, imgh, imgw, x, y, radius, sprite, sprites, key = None, use_label = None):
+		self.height = int(imgh)
+		self.width = int(imgw)
+		self.table = DropTable(x, y, radius, sprite, list(sprites), key = key, use_label = use_label)
+
+	@classmethod
+	def fromTable(cls, table, imgh, imgw):
+		return cls(imgh, imgw, table.x, table.y, table.radius, table.sprite, table.sprites, table.key, table.use_label)
+
+	@classmethod
+	def sample(cls, imgh, imgw, cfg, inputLabel = None, rng = None):
+		"""
+		Place the drops of an imgh x imgw frame and resolve their collisions, see layoutDrops
+		"""
+		from .dropgenerator import layoutDrops
+		return cls.fromTable(layoutDrops(imgh, imgw, cfg, inputLabel, rng), imgh, imgw)
+
+	def __len__(self):
+		return len(self.table)
+
+	def toTable(self):
+		return self.table
+
+	def lensLayer(self, cfg, imgh = None, imgw = None):
+		"""
+		Bake the layout into a LensLayer, for the layout's frame size by default;
+		other sizes keep the drops at the same pixels, clipped to the new frame
+		"""
+		imgh = self.height if imgh is None else imgh
+		imgw = self.width if imgw is None else imgw
+		return LensLayer.fromTable(self.table, imgh, imgw, cfg)
+
+	def apply(self, image, cfg):
+		"""
+		Rain the layout's drops on an HxWx3 uint8 image, returns (image, label)
+		composited drop by drop like generateDropsFromImage, for many images
+		of one size bake lensLayer once instead
+		"""
+		return compositeDrops(image, self.table, cfg, return_label = True)
+
+	def _header(self):
+		sprites = []
+		for s in self.table.sprites:
+			sprites.append({
+				"kind": s.kind,
+				"origin": [int(v) for v in s.origin],
+				"size": list(s.label.shape),
+				"parts": [[int(r), s_shapes, int(blur), int(dx), int(dy)] for r, s_shapes, blur, dx, dy in s.parts],
+			})
+		return {"version": LAYOUT_VERSION, "width": self.width, "height": self.height, "sprites": sprites}
+
+	def save(self, path):
+		"""
+		Write the layout to path, .json (text, generated drops only) or .npz
+		(columns as arrays, also holds the arrays of input label sprites)
+		"""
+		header = self._header()
+		table = self.table
+		if path.lower().endswith(".json"):
+			if not all(s.parts for s in table.sprites):
+				raise ValueError("Drops read from an input label can not be saved as JSON, save the layout as .npz")
+			header["drops"] = {
+				"x": table.x.tolist(),
+				"y": table.y.tolist(),
+				"radius": table.radius.tolist(),
+				"sprite": table.sprite.tolist(),
+				"key": table.key.tolist(),
+				"use_label": table.use_label.tolist(),
+			}
+			with open(path, "w", encoding="utf-8") as f:
+				json.dump(header, f)
+			return
+		arrays = {}
+		for i, s in enumerate(table.sprites):
+			if not s.parts:
+				arrays[f"label_{i}"] = s.label
+				arrays[f"alpha_{i}"] = s.alpha
+		np.savez_compressed(path, header=np.array(json.dumps(header)), x=table.x, y=table.y, radius=table.radius,
+			sprite=table.sprite, key=table.key, use_label=table.use_label, **arrays)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Read a layout written by save, sprites are rebuilt through sprite_cache
+		"""
+		if path.lower().endswith(".json"):
+			with open(path, "r", encoding="utf-8") as f:
+				header = json.load(f)
+			drops = header["drops"]
+			arrays = {}
+		else:
+			with np.load(path) as data:
+				arrays = {name: data[name] for name in data.files}
+			header = json.loads(str(arrays.pop("header")))
+			drops = arrays
+		if header.get("version") != LAYOUT_VERSION:
+			raise ValueError(f"Unsupported drop layout version {header.get('version')!r} in {path}")
+		sprites = []
+		for i, s in enumerate(header["sprites"]):
+			if s["parts"]:
+				parts = tuple((r, _tupled(shapes), blur, dx, dy) for r, shapes, blur, dx, dy in s["parts"])
+				sprites.append(buildSprite(s["kind"], parts, tuple(s["origin"]), tuple(s["size"])))
+			else:
+				label = arrays[f"label_{i}"]
+				alpha = arrays[f"alpha_{i}"]
+				label.flags.writeable = False
+				alpha.flags.writeable = False
+				sprites.append(Sprite(s["kind"], (), label, alpha, tuple(s["origin"])))
+		return cls(header["height"], header["width"], drops["x"], drops["y"], drops["radius"], drops["sprite"], sprites, drops["key"], drops["use_label"])
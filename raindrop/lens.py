@@ -0,0 +1,162 @@
+import cv2
+import numpy as np
+
+from .raindrop import blurBackground, remap_cache, _fisheyeMaps
+from .droptable import clipBoxes
+from .compositing import SparseAlphaMap
+from .config import RENDER_DEFAULTS
+"""
+Background independent lens layer, the drops of a frame baked into one remap and one blend
+
+"""
+
+# remap target for pixels whose refraction falls outside their drop, sampled as black
+_OUTSIDE = -16.0
+
+
+def _floatMaps(radius, h, w, D):
+	"""
+	Float (x, y) maps of a drop's flipped fisheye refraction, converted from the
+	cached fixed-point maps so they sample exactly the same pixels
+	"""
+	def build():
+		map1, map2 = remap_cache.get((radius, h, w, D, True), lambda: _fisheyeMaps(radius, h, w, D, True))
+		map_x, map_y = cv2.convertMaps(map1, map2, cv2.CV_32FC1)
+		# samples leaving the drop's box came out black on the per drop ROI
+		outside = (map_x < 0) | (map_x > w - 1) | (map_y < 0) | (map_y > h - 1)
+		map_x[outside] = _OUTSIDE
+		map_y[outside] = _OUTSIDE
+		map_x.flags.writeable = False
+		map_y.flags.writeable = False
+		return map_x, map_y
+	return remap_cache.get(("float", radius, h, w, D), build)
+
+
+def _blurMargin(radius):
+	# reach of the Gaussian kernel OpenCV builds for an 8 bit image, 3 sigma
+	return int(round(radius*3))
+
+
+class LensLayer():
+	"""
+	Everything the drops of one frame do to an image, independent of the image,
+	kept over box = (x0, y0, x1, y1), the part of the frame the drops cover:
+	map_x / map_y   remap field, where every pixel samples the blurred background (frame coordinates)
+	alpha           how much of the clean image every pixel loses (0-1)
+	edge            weight of the refracted colour, below alpha where the drop edges darken
+	label           full frame uint8 0/1 drop mask, built on first access
+	apply(image) is image * (1 - alpha) + remap(blur(image)) * edge
+	label may be given as the mask or as a function returning it
+	"""
+	def __init__(self, shape, box, map_x, map_y, alpha, edge, label, blur_radius = 5):
+		self.shape = tuple(shape)
+		self.box = tuple(int(v) for v in box)
+		self.map_x = map_x
+		self.map_y = map_y
+		self.alpha = alpha
+		self.edge = edge
+		self._label = label
+		self.blur_radius = blur_radius
+		imgh, imgw = self.shape
+		L, U, R, D = self.box
+		# apply blurs only the box and the rim the blur kernel reads around it,
+		# which gives the same pixels as blurring the whole frame
+		margin = _blurMargin(blur_radius)
+		self._blur_box = (max(L - margin, 0), max(U - margin, 0), min(R + margin, imgw), min(D + margin, imgh))
+		self._map1 = self._map2 = self._keep = self._edge = None
+		if L == R or U == D:
+			# no drop is visible, apply returns the image as is
+			return
+		# maps into the blurred crop and 3 channel weights, built once for every apply
+		self._map1, self._map2 = cv2.convertMaps(map_x - np.float32(self._blur_box[0]), map_y - np.float32(self._blur_box[1]), cv2.CV_16SC2)
+		self._keep = cv2.merge((1 - alpha,) * 3)
+		self._edge = cv2.merge((edge,) * 3)
+
+	@property
+	def label(self):
+		if callable(self._label):
+			self._label = self._label()
+		return self._label
+
+	@classmethod
+	def fromTable(cls, table, imgh, imgw, cfg):
+		"""
+		Bake the drops of a DropTable, in table order (later drops on top),
+		with the same per pixel weights as compositing them one by one
+		"""
+		edge_ratio = cfg["edge_darkratio"]
+		distortion = cfg.get("distortion_coeffs", RENDER_DEFAULTS["distortion_coeffs"])
+		D = (0.0, 0.0, 0.0, 0.0) if distortion is None else tuple(float(d) for d in distortion)
+		maxR = int(table.radius.max()) if len(table) else 1
+
+		# visible part of every drop, in frame (dst) and sprite (src) coordinates
+		boxes = table.boxes()
+		dst, src = clipBoxes(boxes, imgh, imgw)
+		visible = np.flatnonzero((dst[:, 0] < dst[:, 2]) & (dst[:, 1] < dst[:, 3]))
+
+		# add alpha for the edge of the drops, only over the drop boxes
+		alpha_map = SparseAlphaMap(imgh, imgw, 5*maxR)
+		for row in visible:
+			sx0, sy0, sx1, sy1 = src[row]
+			alpha_map.addClipped(dst[row], table.alphaMap(row)[sy0:sy1, sx0:sx1])
+		alpha_peak = alpha_map.max()
+		alpha_scale = 255.0/alpha_peak if alpha_peak > 0 else 0.0
+
+		if len(visible):
+			box = (int(dst[visible, 0].min()), int(dst[visible, 1].min()), int(dst[visible, 2].max()), int(dst[visible, 3].max()))
+		else:
+			box = (0, 0, 0, 0)
+		X0, Y0, X1, Y1 = box
+		# pixels no drop covers have zero weight, where they sample does not matter
+		map_x = np.full((Y1 - Y0, X1 - X0), _OUTSIDE, dtype=np.float32)
+		map_y = np.full((Y1 - Y0, X1 - X0), _OUTSIDE, dtype=np.float32)
+		keep = np.ones((Y1 - Y0, X1 - X0), dtype=np.float32)
+		edge = np.zeros((Y1 - Y0, X1 - X0), dtype=np.float32)
+		for row in visible:
+			L, U, R, D_ = dst[row].tolist()
+			sx0, sy0, sx1, sy1 = src[row].tolist()
+			alphamap = table.alphaMap(row)
+			h, w = alphamap.shape
+			# the texture alpha is flipped along with the refraction
+			tex_alpha = alphamap[::-1][sy0:sy1, sx0:sx1].astype(np.float32) * (1/255)
+			edge_alpha = np.floor(alpha_map.region((L, U, R, D_)) * alpha_scale * tex_alpha) * (1/255)
+			tex_keep = 1 - tex_alpha
+			# compositing this drop over the layers below it
+			region = (slice(U - Y0, D_ - Y0), slice(L - X0, R - X0))
+			weight = (1 - edge_alpha) * tex_keep
+			keep[region] *= weight
+			edge[region] = edge[region] * weight + edge_ratio * edge_alpha * tex_keep + tex_alpha
+
+			# the topmost drop decides where a pixel samples the background, parts
+			# of the sprite off the frame sample the frame's edge
+			drop_x, drop_y = _floatMaps(int(table.radius[row]), h, w, D)
+			drop_x = drop_x[sy0:sy1, sx0:sx1]
+			drop_y = drop_y[sy0:sy1, sx0:sx1]
+			covered = tex_alpha > 0
+			np.copyto(map_x[region], np.clip(drop_x + np.float32(boxes[row, 0]), 0, imgw - 1), where=covered & (drop_x != _OUTSIDE))
+			np.copyto(map_y[region], np.clip(drop_y + np.float32(boxes[row, 1]), 0, imgh - 1), where=covered & (drop_y != _OUTSIDE))
+			# samples leaving the drop stay black
+			np.copyto(map_x[region], _OUTSIDE, where=covered & (drop_x == _OUTSIDE))
+			np.copyto(map_y[region], _OUTSIDE, where=covered & (drop_y == _OUTSIDE))
+
+		return cls((imgh, imgw), box, map_x, map_y, 1 - keep, edge, alpha_map.label)
+
+	def apply(self, image):
+		"""
+		Rain on an HxWx3 uint8 image of the layer's size with one remap and one blend
+		"""
+		if image.shape[:2] != self.shape:
+			raise ValueError(f"Lens layer is {self.shape[1]}x{self.shape[0]}, image is {image.shape[1]}x{image.shape[0]}")
+		output = np.array(image)
+		if self._keep is None:
+			return output
+		L, U, R, D = self.box
+		BL, BU, BR, BD = self._blur_box
+		blurred = blurBackground(image[BU:BD, BL:BR], self.blur_radius)
+		refracted = cv2.remap(blurred, self._map1, self._map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+		out = output[U:D, L:R].astype(np.float32)
+		out *= self._keep
+		out += refracted.astype(np.float32) * self._edge
+		out += 0.5
+		output[U:D, L:R] = out.astype(np.uint8)
+		return output
@@ -0,0 +1,98 @@
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from .dropgenerator import generateDropsFromImage, _decodeImage
+from .rng import makeRng
+"""
+Streaming render pipeline, decoding and encoding run on threads around the renderer
+
+"""
+
+# item is the input as given, image / label the rendered arrays (label is None
+# unless cfg["return_label"]), error the exception of a failed item
+Rendered = namedtuple("Rendered", ["item", "image", "label", "render_time", "error"])
+
+
+def loadImage(item):
+	"""
+	Decode a path, encoded bytes, PIL.Image or ndarray into an HxWx3 uint8 array
+	"""
+	if isinstance(item, str):
+		item = Image.open(item)
+	return _decodeImage(item)
+
+
+def _decode(load, item):
+	try:
+		return load(item), None
+	except Exception as e:
+		return None, e
+
+
+def iterGenerate(inputs, cfg, writer = None, seeds = None, load = loadImage, decode_threads = 2, encode_threads = 2, prefetch = 8, queue_size = 8, errors = "raise", rng = None):
+	"""
+	Render a stream of images, yielding in input order
+	decoder threads keep up to prefetch decoded images ahead of the renderer and
+	without a writer every Rendered is yielded; with one, writer(rendered) runs on
+	the encoder threads and its results are yielded instead, with at most
+	queue_size renders waiting to be written. Both queues are bounded, so memory
+	stays flat however long inputs is, and the caller is blocked when it falls behind
+	seeds, if given, seeds every render with its own Generator, either an
+	iterable of seeds running along inputs or a function of the item; without
+	them renders draw one after the other from rng (see makeRng)
+	errors="yield" turns failed items into Rendered with error set instead of raising
+	"""
+	seed_of = seeds if callable(seeds) else None
+	seeds = iter(seeds) if seeds is not None and seed_of is None else None
+	rng = makeRng(rng) if seeds is None and seed_of is None else None
+	inputs = iter(inputs)
+	decoded = deque()
+	encoded = deque()
+	with ThreadPoolExecutor(max_workers=decode_threads) as decoders, \
+			ThreadPoolExecutor(max_workers=encode_threads) as encoders:
+		def fill():
+			for item in inputs:
+				decoded.append((item, decoders.submit(_decode, load, item)))
+				if len(decoded) >= prefetch:
+					break
+
+		fill()
+		while decoded:
+			item, future = decoded.popleft()
+			fill()
+			image, error = future.result()
+			output_image = output_label = None
+			start = time.perf_counter()
+			if error is None:
+				if seed_of is not None:
+					render_rng = makeRng(seed_of(item))
+				elif seeds is not None:
+					render_rng = makeRng(next(seeds))
+				else:
+					render_rng = rng
+				try:
+					output = generateDropsFromImage(image, cfg, as_array=True, rng=render_rng)
+				except Exception as e:
+					error = e
+				else:
+					if cfg["return_label"]:
+						output_image, output_label = output
+					else:
+						output_image = output
+			elif seeds is not None:
+				# keep seeds aligned with the inputs
+				next(seeds)
+			if error is not None and errors == "raise":
+				raise error
+			rendered = Rendered(item, output_image, output_label, time.perf_counter() - start, error)
+			if writer is None:
+				yield rendered
+				continue
+			encoded.append(encoders.submit(writer, rendered))
+			while len(encoded) > queue_size:
+				yield encoded.popleft().result()
+		while encoded:
+			yield encoded.popleft().result()
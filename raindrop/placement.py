@@ -0,0 +1,54 @@
+from .rng import makeRng
+"""
+Drop center samplers
+
+"""
+
+
+def _conflicts(x, y, R, ox, oy, oR):
+	"""
+	True if either center lies in the other's footprint, 2R to the sides, 3R up and 2R down
+	"""
+	dx = ox - x
+	dy = oy - y
+	return (-2*R <= dx < 2*R and -3*R <= dy < 2*R) or (-2*oR <= -dx < 2*oR and -3*oR <= -dy < 2*oR)
+
+
+def samplePoissonDisk(radii, imgw, imgh, max_attempts = 30, rng = None):
+	"""
+	Grid accelerated dart throwing, one center per radius such that no center
+	falls inside another drop's footprint, so drops start out collision free
+	a drop that finds no free spot in max_attempts darts keeps its last
+	uniform draw and is left to the regular collision pass
+	darts are drawn from rng, a numpy Generator or seed (see makeRng)
+	"""
+	if len(radii) == 0:
+		return []
+	rng = makeRng(rng)
+	radii = [int(R) for R in radii]
+	# a conflicting center is at most 3*maxR away on either axis
+	cell = 3*max(radii)
+	grid = {}
+	placed = []
+	for R in radii:
+		for attempt in range(max_attempts):
+			x = int(rng.random() * imgw)
+			y = int(rng.random() * imgh)
+			cx, cy = x // cell, y // cell
+			free = True
+			for gx in (cx - 1, cx, cx + 1):
+				for gy in (cy - 1, cy, cy + 1):
+					for n in grid.get((gx, gy), ()):
+						(ox, oy), oR = placed[n]
+						if _conflicts(x, y, R, ox, oy, oR):
+							free = False
+							break
+					if not free:
+						break
+				if not free:
+					break
+			if free:
+				break
+		grid.setdefault((cx, cy), []).append(len(placed))
+		placed.append(((x, y), R))
+	return [pos for pos, R in placed]
@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import LRUCache
+from .config import RENDER_DEFAULTS
+from .encoders import ENCODER_KEYS
+from .dropgenerator import generateDropsFromImage, RENDER_VERSION
+from .pipeline import loadImage
+from .rng import sampleSeed
+"""
+Procedural datasets, samples stored as (source, config, seed) and rendered when read
+
+"""
+
+# 2: configs are filled from RENDER_DEFAULTS, version 1 filled them from the
+# package cfg, whose values the renderer does not fall back to
+INDEX_VERSION = 2
+
+
+def normalizeCfg(cfg):
+	"""
+	The render relevant part of cfg: optional entries it leaves out filled in
+	from RENDER_DEFAULTS (what the renderer falls back to), allowed_shapes
+	dropped when shape_variety is off, encoder and return_label entries
+	dropped and tuples turned into lists, as JSON would
+	"""
+	merged = dict(RENDER_DEFAULTS, **cfg)
+	for key in ENCODER_KEYS + ("return_label",):
+		merged.pop(key, None)
+	if not merged["shape_variety"]:
+		merged.pop("allowed_shapes")
+	return json.loads(json.dumps(merged, sort_keys=True))
+
+
+def cfgFingerprint(cfg):
+	"""
+	Short stable hash of normalizeCfg(cfg), equal for configs that render alike
+	"""
+	text = json.dumps(normalizeCfg(cfg), sort_keys=True, separators=(",", ":"))
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def writeIndex(path, sources, cfgs, variants = 1, seed = 0, root = None):
+	"""
+	Write the index of a procedural dataset: variants samples of every source
+	image under every config of cfgs (one cfg dict or a list of them)
+	sources are image paths relative to root; each sample stores its source,
+	config fingerprint and a seed derived from the run seed and the source
+	name, so adding sources leaves the seeds of the others unchanged
+	returns the number of samples
+	"""
+	if isinstance(cfgs, dict):
+		cfgs = [cfgs]
+	configs = {cfgFingerprint(c): normalizeCfg(c) for c in cfgs}
+	sources = list(sources)
+	samples = []
+	for source, name in enumerate(sources):
+		for fingerprint in configs:
+			for variant in range(variants):
+				samples.append([source, fingerprint, sampleSeed(seed, _nameSeed(name, fingerprint), variant)])
+	index = {
+		"version": INDEX_VERSION,
+		"render_version": RENDER_VERSION,
+		"root": root,
+		"sources": sources,
+		"configs": configs,
+		"samples": samples,
+	}
+	tmp_path = path + ".tmp"
+	with open(tmp_path, "w", encoding="utf-8") as f:
+		json.dump(index, f, separators=(",", ":"))
+	os.replace(tmp_path, path)
+	return len(samples)
+
+
+def _nameSeed(name, fingerprint):
+	return int.from_bytes(hashlib.sha256(f"{name}:{fingerprint}".encode("utf-8")).digest()[:8], "little")
+
+
+class ProceduralDataset():
+	"""
+	Samples of an index written by writeIndex, rendered deterministically on
+	every read: dataset[i] is the (image, label) pair of sample i, HxWx3 and
+	HxW uint8 arrays. cache_size keeps that many rendered samples in an LRU
+	cache and source_cache_size that many decoded source images (variants of
+	one source read together decode it once); cached arrays are read-only
+	root overrides the image folder stored in the index
+	"""
+	def __init__(self, index_path, root = None, cache_size = 0, source_cache_size = 0):
+		with open(index_path, "r", encoding="utf-8") as f:
+			index = json.load(f)
+		if index.get("version") != INDEX_VERSION:
+			raise ValueError(f"Unsupported procedural index version {index.get('version')!r} in {index_path}")
+		if index.get("render_version") != RENDER_VERSION:
+			raise ValueError(f"{index_path} was indexed for render version {index.get('render_version')}, "
+				f"this renderer is version {RENDER_VERSION} and would render different samples")
+		self.root = index.get("root") if root is None else root
+		if self.root is None:
+			self.root = os.path.dirname(os.path.abspath(index_path))
+		self.sources = index["sources"]
+		self.configs = {}
+		for fingerprint, c in index["configs"].items():
+			if cfgFingerprint(c) != fingerprint:
+				raise ValueError(f"Config {fingerprint} in {index_path} does not match its fingerprint")
+			self.configs[fingerprint] = dict(c, return_label=True)
+		self.samples = index["samples"]
+		self._cache = LRUCache(cache_size) if cache_size > 0 else None
+		self._sources = LRUCache(source_cache_size) if source_cache_size > 0 else None
+
+	def __len__(self):
+		return len(self.samples)
+
+	def sample(self, i):
+		"""
+		(source path, cfg, seed) of sample i
+		"""
+		source, fingerprint, seed = self.samples[i]
+		return os.path.join(self.root, self.sources[source]), self.configs[fingerprint], seed
+
+	def _source(self, path):
+		if self._sources is None:
+			return loadImage(path)
+		return self._sources.get(path, lambda: _readOnly(loadImage(path)))
+
+	def render(self, i):
+		"""
+		Render sample i without the sample cache
+		"""
+		path, cfg, seed = self.sample(i)
+		return generateDropsFromImage(self._source(path), cfg, as_array=True, rng=seed)
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError(f"sample {i} out of range for {len(self)} samples")
+		if self._cache is None:
+			return self.render(i)
+		return self._cache.get(i, lambda: tuple(_readOnly(a) for a in self.render(i)))
+
+	def iterate(self, indices = None, threads = 4, prefetch = 8):
+		"""
+		Yield (i, image, label) for indices (all samples by default) in order,
+		rendering up to prefetch samples ahead on threads; OpenCV and NumPy
+		release the GIL for most of a render, so threads overlap well
+		"""
+		indices = iter(range(len(self)) if indices is None else indices)
+		pending = deque()
+		with ThreadPoolExecutor(max_workers=threads) as pool:
+			for i in indices:
+				pending.append((i, pool.submit(self.__getitem__, i)))
+				if len(pending) >= prefetch:
+					i, future = pending.popleft()
+					yield (i,) + tuple(future.result())
+			while pending:
+				i, future = pending.popleft()
+				yield (i,) + tuple(future.result())
+
+	def info(self):
+		return {
+			"samples": len(self),
+			"sources": len(self.sources),
+			"configs": len(self.configs),
+			"cache": None if self._cache is None else self._cache.info(),
+			"source_cache": None if self._sources is None else self._sources.info(),
+		}
+
+
+def _readOnly(array):
+	array.flags.writeable = False
+	return array
@@ -1,197 +1,352 @@
 import cv2
 import math
 import numpy as np
-import random
 from PIL import Image, ImageFilter
 
+from .cache import LRUCache
+from .droptable import DropTable, Sprite, SHAPES
+from .rng import makeRng, randint, choice
 
-class raindrop():
-	def __init__(self, key, centerxy = None, radius = None, input_alpha = None, input_label = None, droplet_type = None):
-		if input_label is None:
-			self.key = key		
-			self.ifcol = False	
-			self.col_with = []
-			self.center = centerxy
-			self.radius = radius
-			# Random droplet type if not specified
-			if droplet_type is None:
-				self.type = random.choice(["default", "round", "oval", "teardrop", "irregular", "splash"])
-			else:
-				self.type = droplet_type
-			# label map's WxH = 4*R , 5*R
-			self.labelmap = np.zeros((self.radius * 5, self.radius*4))
-			self.alphamap = np.zeros((self.radius * 5, self.radius*4))
-			self.background = None
-			self.texture = None
-			self._create_label()
-			self.use_label = False
+# sprites only depend on their cache key, so every drop shares them
+sprite_cache = LRUCache(maxsize = 512)
+# fisheye remap tables only depend on radius, ROI size, distortion and flip
+remap_cache = LRUCache(maxsize = 128)
+
+
+def _rasteriseSprite(radius, shapes, blur_radius):
+	"""
+	Draw the sprite primitives and blur them into a read-only (label, alpha) pair
+	the label is bool and the alpha uint8, truncated like the texture alpha always was
+	"""
+	labelmap = np.zeros((radius * 5, radius * 4), dtype=np.uint8)
+	for shape in shapes:
+		if shape[0] == "circle":
+			cv2.circle(labelmap, shape[1], shape[2], 128, -1)
 		else:
-			self.key = key
-			assert input_alpha is not None, "Please also input the alpha map"
-			self.alphamap = input_alpha
-			self.labelmap =input_label
-			self.ifcol = False
-			self.col_with = []
-			# default shape should be [h,w]			
-			h, w = self.labelmap.shape
-			# set the label center
-			self.center = centerxy
-			self.radius = min(w//4, h//4)
-			self.background = None
-			self.texture = None
-			self.use_label = True
+			cv2.ellipse(labelmap, shape[1], shape[2], shape[3], shape[4], shape[5], 128, -1)
+	alphamap = np.asarray(Image.fromarray(labelmap).filter(ImageFilter.GaussianBlur(radius=blur_radius)))
+	# Ensure alphamap has proper values
+	peak = int(alphamap.max())
+	if peak > 0:
+		alphamap = (alphamap / peak * 255.0).astype(np.uint8)
+	else:
+		alphamap = np.zeros_like(alphamap)
+	# set label map
+	labelmap = labelmap > 0
+	labelmap.flags.writeable = False
+	alphamap.flags.writeable = False
+	return labelmap, alphamap
 
-	def setCollision(self, col, col_with):
-		self.ifcol = col
-		self.col_with = col_with
 
-	def updateTexture(self, bg):		
-		# Replace pyblur.GaussianBlur with PIL ImageFilter.GaussianBlur
-		fg = Image.fromarray(np.uint8(bg)).filter(ImageFilter.GaussianBlur(radius=5))
-		fg = np.asarray(fg)
-		
+def blurBackground(img, radius = 5):
+	"""
+	Separable Gaussian blur standing in for PIL's GaussianBlur(radius)
+	on uint8 images it stays within a mean of 0.2 and a max of 4 grey levels
+	of the PIL result (edge pixels replicated like PIL); blurring the whole
+	frame once instead of every ROI keeps rendered drops within 2 grey levels
+	"""
+	return cv2.GaussianBlur(img, (0, 0), radius, borderType = cv2.BORDER_REPLICATE)
 
-		# Ensure background has proper dimensions for camera matrix
-		h, w = fg.shape[:2]
-		
-		K = np.array([[30*self.radius, 0, w/2],
-				[0., 20*self.radius, h/2],
-				[0., 0., 1]], dtype=np.float64)
-		D = np.array([0.0, 0.0, 0.0, 0.0], dtype=np.float64)
-		Knew = K.copy()
-		scale_factor = math.pow(self.radius, 1/3)*2
-		Knew[0,0] = K[0,0] * scale_factor
-		Knew[1,1] = K[1,1] * scale_factor
-		
-		# Ensure proper data types for OpenCV fisheye
-		try:
-			fisheye = cv2.fisheye.undistortImage(fg, K, D=D, Knew=Knew)
-		except Exception as e:
-			# Fallback: use regular undistortion if fisheye fails
-			print(f"Fisheye distortion failed: {e}, using original image")
-			fisheye = fg.copy()
-		
 
-		target_height, target_width = self.alphamap.shape
-		if fisheye.shape[:2] != (target_height, target_width):
-			fisheye = cv2.resize(fisheye, (target_width, target_height))
-		
-		# Ensure alphamap is in correct format
-		alpha_channel = self.alphamap.astype(np.uint8)
-		tmp = np.expand_dims(alpha_channel, axis = -1)		
-		tmp = np.concatenate((fisheye, tmp), axis = 2)
-		
-		self.texture = Image.fromarray(tmp.astype('uint8'), 'RGBA')
-		self.texture = self.texture.transpose(Image.FLIP_TOP_BOTTOM)
+def _fisheyeMaps(radius, h, w, D, flip):
+	"""
+	Build the fixed-point (CV_16SC2 + interpolation table) fisheye remap maps
+	for an h x w ROI, optionally with the vertical flip folded in
+	"""
+	K = np.array([[30*radius, 0, w/2],
+			[0., 20*radius, h/2],
+			[0., 0., 1]], dtype=np.float64)
+	Knew = K.copy()
+	scale_factor = math.pow(radius, 1/3)*2
+	Knew[0,0] = K[0,0] * scale_factor
+	Knew[1,1] = K[1,1] * scale_factor
+	map1, map2 = cv2.fisheye.initUndistortRectifyMap(K, np.array(D, dtype=np.float64), np.eye(3), Knew, (w, h), cv2.CV_16SC2)
+	if flip:
+		map1 = np.ascontiguousarray(map1[::-1])
+		map2 = np.ascontiguousarray(map2[::-1])
+	map1.flags.writeable = False
+	map2.flags.writeable = False
+	return map1, map2
 
 
-		
-	# create the raindrop label
-	def _create_label(self):
-		if self.type == "default":
-			self._createDefaultDrop()
-		elif self.type == "round":
-			self._createRoundDrop()
-		elif self.type == "oval":
-			self._createOvalDrop()
-		elif self.type == "teardrop":
-			self._createTeardropDrop()
-		elif self.type == "irregular":
-			self._createIrregularDrop()
-		elif self.type == "splash":
-			self._createSplashDrop()
-		else:
-			# Fallback to default
-			self._createDefaultDrop()
-
-	def _createDefaultDrop(self):
-		"""Original teardrop shape (circle + ellipse)"""
-		cv2.circle(self.labelmap, (self.radius * 2, self.radius * 3), self.radius, 128, -1)
-		cv2.ellipse(self.labelmap, (self.radius * 2, self.radius * 3), (self.radius, int(1.3*math.sqrt(3) * self.radius)), 0, 180, 360, 128, -1)		
-		self._apply_alpha_map()
-
-	def _createRoundDrop(self):
-		"""Perfect circular droplet"""
-		cv2.circle(self.labelmap, (self.radius * 2, self.radius * 2), self.radius, 128, -1)
-		# Apply alpha mapping
-		self._apply_alpha_map()
-
-	def _createOvalDrop(self):
-		"""Oval-shaped droplet with random orientation"""
-		angle = random.randint(0, 180)
-		aspect_ratio = random.uniform(1.2, 2.0)
-		axes = (self.radius, int(self.radius * aspect_ratio))
-		cv2.ellipse(self.labelmap, (self.radius * 2, self.radius * 2), axes, angle, 0, 360, 128, -1)
-		self._apply_alpha_map()
-
-	def _createTeardropDrop(self):
-		"""Enhanced teardrop with random variation"""
+def refract(bg, radius, alphamap, D = None, blurred = False):
+	"""
+	Refract the background ROI through a drop into its HxWx4 RGBA texture
+	alphamap is the drop's alpha sprite, which also sets the texture size
+	D are the fisheye distortion coefficients (k1, k2, k3, k4), zero by default
+	blurred tells that bg is already a slice of blurBackground(image)
+	"""
+	fg = bg if blurred else blurBackground(np.uint8(bg))
+	
+
+	# Ensure background has proper dimensions for camera matrix
+	h, w = fg.shape[:2]
+	D = (0.0, 0.0, 0.0, 0.0) if D is None else tuple(float(d) for d in D)
+	target_height, target_width = alphamap.shape
+	# the texture is flipped top to bottom, fold that into the table
+	# unless the ROI still has to be resized to the sprite
+	fold_flip = (h, w) == (target_height, target_width)
+	
+	try:
+		map1, map2 = remap_cache.get((radius, h, w, D, fold_flip), lambda: _fisheyeMaps(radius, h, w, D, fold_flip))
+		fisheye = cv2.remap(fg, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+	except Exception as e:
+		# Fallback: use regular undistortion if fisheye fails
+		print(f"Fisheye distortion failed: {e}, using original image")
+		fisheye = fg[::-1] if fold_flip else fg.copy()
+	
+
+	if not fold_flip:
+		fisheye = cv2.resize(fisheye, (target_width, target_height))[::-1]
+	
+	# the texture alpha is flipped along with the refraction
+	return np.dstack((fisheye, alphamap[::-1]))
+
+
+def _defaultShapes(radius, rng):
+	"""Original teardrop shape (circle + ellipse)"""
+	center = (radius * 2, radius * 3)
+	return (
+		("circle", center, radius),
+		("ellipse", center, (radius, int(1.3*math.sqrt(3) * radius)), 0, 180, 360),
+	)
+
+
+def _roundShapes(radius, rng):
+	"""Perfect circular droplet"""
+	return (
+		("circle", (radius * 2, radius * 2), radius),
+	)
+
+
+def _ovalShapes(radius, rng):
+	"""Oval-shaped droplet with random orientation"""
+	angle = randint(rng, 0, 180)
+	aspect_ratio = rng.uniform(1.2, 2.0)
+	axes = (radius, int(radius * aspect_ratio))
+	return (
+		("ellipse", (radius * 2, radius * 2), axes, angle, 0, 360),
+	)
+
+
+def _teardropShapes(radius, rng):
+	"""Enhanced teardrop with random variation"""
+	center = (radius * 2, radius * 3)
+	# Variable ellipse for teardrop effect
+	ellipse_ratio = rng.uniform(1.1, 1.5)
+	angle_variation = randint(rng, -15, 15)
+	return (
 		# Main circle
-		cv2.circle(self.labelmap, (self.radius * 2, self.radius * 3), self.radius, 128, -1)
-		# Variable ellipse for teardrop effect
-		ellipse_ratio = random.uniform(1.1, 1.5)
-		angle_variation = random.randint(-15, 15)
-		cv2.ellipse(self.labelmap, (self.radius * 2, self.radius * 3), 
-		           (self.radius, int(ellipse_ratio * math.sqrt(3) * self.radius)), 
-		           angle_variation, 180, 360, 128, -1)
-		self._apply_alpha_map()
-
-	def _createIrregularDrop(self):
-		"""Irregular droplet with random distortions"""
-		# Start with basic circle
-		center = (self.radius * 2, self.radius * 2)
-		
-		# Create irregular shape using multiple overlapping circles
-		num_perturbations = random.randint(3, 6)
-		for i in range(num_perturbations):
-			# Random offset from center
-			offset_x = random.randint(-self.radius//3, self.radius//3)
-			offset_y = random.randint(-self.radius//3, self.radius//3)
-			perturb_radius = random.randint(self.radius//2, int(self.radius * 0.8))
-			
-			perturb_center = (center[0] + offset_x, center[1] + offset_y)
-			cv2.circle(self.labelmap, perturb_center, perturb_radius, 128, -1)
-		
-		self._apply_alpha_map()
+		("circle", center, radius),
+		("ellipse", center, (radius, int(ellipse_ratio * math.sqrt(3) * radius)), angle_variation, 180, 360),
+	)
 
-	def _createSplashDrop(self):
-		"""Splash-like droplet with multiple small circles"""
-		# Main droplet
-		main_radius = int(self.radius * 0.7)
-		cv2.circle(self.labelmap, (self.radius * 2, self.radius * 2), main_radius, 128, -1)
+
+def _irregularShapes(radius, rng):
+	"""Irregular droplet with random distortions"""
+	# Start with basic circle
+	center = (radius * 2, radius * 2)
+	
+	# Create irregular shape using multiple overlapping circles
+	shapes = []
+	num_perturbations = randint(rng, 3, 6)
+	for i in range(num_perturbations):
+		# Random offset from center
+		offset_x = randint(rng, -radius//3, radius//3)
+		offset_y = randint(rng, -radius//3, radius//3)
+		perturb_radius = randint(rng, radius//2, int(radius * 0.8))
 		
-		# Add satellite droplets
-		num_satellites = random.randint(2, 5)
-		for i in range(num_satellites):
-			# Random position around main droplet
-			angle = random.uniform(0, 2 * math.pi)
-			distance = random.randint(main_radius, int(self.radius * 1.5))
-			sat_x = int(self.radius * 2 + distance * math.cos(angle))
-			sat_y = int(self.radius * 2 + distance * math.sin(angle))
-			sat_radius = random.randint(self.radius//4, self.radius//2)
-			
-			# Ensure within bounds
-			if (0 <= sat_x < self.labelmap.shape[1] and 0 <= sat_y < self.labelmap.shape[0]):
-				cv2.circle(self.labelmap, (sat_x, sat_y), sat_radius, 128, -1)
+		perturb_center = (center[0] + offset_x, center[1] + offset_y)
+		shapes.append(("circle", perturb_center, perturb_radius))
+	
+	return tuple(shapes)
+
+
+def _splashShapes(radius, rng):
+	"""Splash-like droplet with multiple small circles"""
+	# Main droplet
+	main_radius = int(radius * 0.7)
+	shapes = [("circle", (radius * 2, radius * 2), main_radius)]
+	
+	# Add satellite droplets
+	num_satellites = randint(rng, 2, 5)
+	for i in range(num_satellites):
+		# Random position around main droplet
+		angle = rng.uniform(0, 2 * math.pi)
+		distance = randint(rng, main_radius, int(radius * 1.5))
+		sat_x = int(radius * 2 + distance * math.cos(angle))
+		sat_y = int(radius * 2 + distance * math.sin(angle))
+		sat_radius = randint(rng, radius//4, radius//2)
 		
-		self._apply_alpha_map()
-
-	def _apply_alpha_map(self):
-		"""Common alpha map application for all droplet types"""
-		# Apply random blur intensity for variation
-		blur_radius = random.randint(8, 12)
-		self.alphamap = Image.fromarray(np.uint8(self.labelmap)).filter(ImageFilter.GaussianBlur(radius=blur_radius))
-		self.alphamap = np.asarray(self.alphamap).astype(np.float64)
-		# Ensure alphamap has proper values
-		if np.max(self.alphamap) > 0:
-			self.alphamap = self.alphamap/np.max(self.alphamap)*255.0
+		# Ensure within bounds
+		if (0 <= sat_x < radius * 4 and 0 <= sat_y < radius * 5):
+			shapes.append(("circle", (sat_x, sat_y), sat_radius))
+	
+	return tuple(shapes)
+
+
+_SHAPE_SAMPLERS = {
+	"default": _defaultShapes,
+	"round": _roundShapes,
+	"oval": _ovalShapes,
+	"teardrop": _teardropShapes,
+	"irregular": _irregularShapes,
+	"splash": _splashShapes,
+}
+
+
+def sampleSprite(radius, droplet_type = None, rng = None):
+	"""
+	Draw the random shape parameters and blur of a drop from rng (a numpy
+	Generator or seed, see makeRng) and fetch its Sprite
+	the integer draw primitives, radius and blur fully determine the sprite and
+	serve as its sprite_cache key; unknown types are drawn as the default shape
+	"""
+	rng = makeRng(rng)
+	# Random droplet type if not specified
+	if droplet_type is None:
+		droplet_type = choice(rng, SHAPES)
+	shapes = _SHAPE_SAMPLERS.get(droplet_type, _defaultShapes)(radius, rng)
+	# Apply random blur intensity for variation
+	blur_radius = randint(rng, 8, 12)
+	key = (droplet_type, radius, shapes, blur_radius)
+	labelmap, alphamap = sprite_cache.get(key, lambda: _rasteriseSprite(radius, shapes, blur_radius))
+	return Sprite(droplet_type, shapes, labelmap, alphamap, (2*radius, 3*radius), ((radius, shapes, blur_radius, 0, 0),))
+
+
+def _moveShape(shape, dx, dy):
+	(sx, sy) = shape[1]
+	return (shape[0], (sx + dx, sy + dy)) + tuple(shape[2:])
+
+
+def mergeSprites(sprites, centers, radii, center):
+	"""
+	Combine the sprites of merging drops into the sprite of the merged drop
+	every sprite is placed at its drop's position on a canvas spanning them all,
+	labels are united, alphas max-composited and the draw primitives moved along;
+	the merged drop takes the type of its largest member and is centered at center
+	"""
+	boxes = [(cx - s.origin[0], cy - s.origin[1]) for s, (cx, cy) in zip(sprites, centers)]
+	X0 = min(x0 for x0, _ in boxes)
+	Y0 = min(y0 for _, y0 in boxes)
+	X1 = max(x0 + s.label.shape[1] for s, (x0, _) in zip(sprites, boxes))
+	Y1 = max(y0 + s.label.shape[0] for s, (_, y0) in zip(sprites, boxes))
+	labelmap = np.zeros((Y1 - Y0, X1 - X0), dtype=bool)
+	alphamap = np.zeros((Y1 - Y0, X1 - X0), dtype=np.uint8)
+	shapes = []
+	parts = []
+	for s, (x0, y0) in zip(sprites, boxes):
+		h, w = s.label.shape
+		dx, dy = x0 - X0, y0 - Y0
+		labelmap[dy:dy + h, dx:dx + w] |= s.label
+		np.maximum(alphamap[dy:dy + h, dx:dx + w], s.alpha, out = alphamap[dy:dy + h, dx:dx + w])
+		shapes.extend(_moveShape(shape, dx, dy) for shape in s.shapes)
+		parts.extend((r, p_shapes, blur, px + dx, py + dy) for r, p_shapes, blur, px, py in s.parts)
+	labelmap.flags.writeable = False
+	alphamap.flags.writeable = False
+	kind = sprites[int(np.argmax(radii))].kind
+	# members without a recipe make the merged sprite unrebuildable as well
+	if not all(s.parts for s in sprites):
+		parts = []
+	return Sprite(kind, tuple(shapes), labelmap, alphamap, (center[0] - X0, center[1] - Y0), tuple(parts))
+
+
+def buildSprite(kind, parts, origin, size = None):
+	"""
+	Rebuild a Sprite from its recipe, the parts are rasterised through sprite_cache
+	and united / max-composited on a canvas of size (h, w), by default just
+	large enough for all parts; the inverse of Sprite.parts
+	"""
+	rasters = []
+	for radius, shapes, blur_radius, dx, dy in parts:
+		key = (kind, radius, shapes, blur_radius)
+		rasters.append((sprite_cache.get(key, lambda: _rasteriseSprite(radius, shapes, blur_radius)), dx, dy))
+	if size is None:
+		size = (max(dy + label.shape[0] for (label, _), _, dy in rasters), max(dx + label.shape[1] for (label, _), dx, _ in rasters))
+	parts = tuple(parts)
+	if len(rasters) == 1 and rasters[0][1:] == (0, 0) and rasters[0][0][0].shape == tuple(size):
+		# a single sampled sprite, shared straight from the cache
+		labelmap, alphamap = rasters[0][0]
+		return Sprite(kind, parts[0][1], labelmap, alphamap, tuple(origin), parts)
+	labelmap = np.zeros(size, dtype=bool)
+	alphamap = np.zeros(size, dtype=np.uint8)
+	shapes = []
+	for (label, alpha), dx, dy in rasters:
+		h, w = label.shape
+		labelmap[dy:dy + h, dx:dx + w] |= label
+		np.maximum(alphamap[dy:dy + h, dx:dx + w], alpha, out = alphamap[dy:dy + h, dx:dx + w])
+	for _, p_shapes, _, dx, dy in parts:
+		shapes.extend(_moveShape(shape, dx, dy) for shape in p_shapes)
+	labelmap.flags.writeable = False
+	alphamap.flags.writeable = False
+	return Sprite(kind, tuple(shapes), labelmap, alphamap, tuple(origin), parts)
+
+
+class raindrop():
+	"""
+	View over one row of a DropTable, a drop built on its own gets a one row table
+	"""
+	def __init__(self, key, centerxy = None, radius = None, input_alpha = None, input_label = None, droplet_type = None, rng = None):
+		if input_label is None:
+			# label map's WxH = 4*R , 5*R, shared read-only from sprite_cache
+			table = DropTable.fromDrops([centerxy], [radius], [sampleSprite(radius, droplet_type, rng)], keys = [key])
 		else:
-			self.alphamap = np.zeros_like(self.alphamap)
-		# set label map
-		self.labelmap[self.labelmap>0] = 1
+			assert input_alpha is not None, "Please also input the alpha map"
+			# default shape should be [h,w]
+			h, w = input_label.shape
+			# the center of a label drop is its left top
+			sprite = Sprite("label", (), input_label, input_alpha, (0, 0))
+			table = DropTable.fromDrops([centerxy], [min(w//4, h//4)], [sprite], keys = [key], use_label = True)
+		self._bind(table, 0)
+
+	@classmethod
+	def view(cls, table, row):
+		drop = cls.__new__(cls)
+		drop._bind(table, row)
+		return drop
+
+	def _bind(self, table, row):
+		self.table = table
+		self.row = row
+		self.texture = None
+
+	@property
+	def type(self):
+		return self.table.sprites[self.table.sprite[self.row]].kind
+
+	@property
+	def labelmap(self):
+		return self.table.labelMap(self.row)
+
+	@property
+	def alphamap(self):
+		return self.table.alphaMap(self.row)
+
+	@property
+	def radius(self):
+		return int(self.table.radius[self.row])
+
+	def setCollision(self, col, col_with):
+		table = self.table
+		keep = table.col_rows != self.row
+		rows = table.col_rows[keep]
+		others = table.col_with[keep]
+		if col:
+			position = {int(k): n for n, k in enumerate(table.key)}
+			with_rows = [position[int(k)] for k in col_with]
+			rows = np.concatenate((rows, np.full(len(with_rows), self.row, dtype=np.int64)))
+			others = np.concatenate((others, np.asarray(with_rows, dtype=np.int64)))
+		table.setCollisions(rows, others)
+		table.colli[self.row] = bool(col)
+
+	def updateTexture(self, bg, D = None, blurred = False):
+		"""
+		Refract the background ROI through the drop, see refract()
+		"""
+		self.texture = refract(bg, self.radius, self.alphamap, D, blurred)
 
 	def setKey(self, key):
-		self.key = key
+		self.table.key[self.row] = key
 
 	def getLabelMap(self):
 		return self.labelmap
@@ -200,22 +355,32 @@ class raindrop():
 		return self.alphamap
 
 	def getTexture(self):
+		# None until updateTexture, as it always was
+		if self.texture is None:
+			return None
+		return Image.fromarray(self.texture, 'RGBA')
+
+	def getTextureArray(self):
 		return self.texture
 
 	def getCenters(self):
-		return self.center
+		return (int(self.table.x[self.row]), int(self.table.y[self.row]))
 		
 	def getRadius(self):
 		return self.radius
 
 	def getKey(self):
-		return self.key
+		return int(self.table.key[self.row])
 
 	def getIfColli(self):
-		return self.ifcol
+		return bool(self.table.colli[self.row])
 
 	def getCollisionList(self):
-		return self.col_with
+		table = self.table
+		return [int(k) for k in table.key[table.col_with[table.col_rows == self.row]]]
+
+	def getShapes(self):
+		return self.table.shapes(self.row)
 	
 	def getUseLabel(self):
-		return self.use_label
\ No newline at end of file
+		return bool(self.table.use_label[self.row])
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import numbers
+import hashlib
+import tempfile
+import threading
+
+from .dropgenerator import generateDropsFromImage, RENDER_VERSION
+from .encoders import ENCODER_KEYS, encodeImage, encodeLabel
+from .procedural import normalizeCfg
+"""
+Content addressed on-disk cache of encoded renders, shared safely between processes
+
+"""
+
+# a writer that died mid-write leaves its temporary file, swept once it is this old
+_STALE_TMP = 3600
+# 2: configs are normalized with RENDER_DEFAULTS, a version 1 key of a cfg
+# leaving out allowed_shapes equals the key of a cfg listing all shapes
+_KEY_VERSION = 2
+
+
+def renderKey(data, cfg, seed, image_ext = ".jpg", label_ext = ".png"):
+	"""
+	Cache key of a render: sha256 over the encoded input bytes, the render
+	relevant cfg (normalizeCfg), the encoder settings and extensions the
+	outputs are encoded with, the seed and RENDER_VERSION; configs that render
+	differently get different keys
+	"""
+	if isinstance(seed, bool) or not isinstance(seed, numbers.Integral):
+		raise TypeError(f"Cached renders need an integer seed, got {type(seed).__name__}")
+	seed = int(seed)
+	settings = {
+		"cfg": normalizeCfg(cfg),
+		"encoders": {key: cfg.get(key) for key in ENCODER_KEYS},
+		"image_ext": image_ext.lower(),
+		"label_ext": label_ext.lower(),
+		"seed": seed,
+		"render_version": RENDER_VERSION,
+		"key_version": _KEY_VERSION,
+	}
+	h = hashlib.sha256(hashlib.sha256(data).digest())
+	h.update(json.dumps(settings, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+	return h.hexdigest()
+
+
+class RenderCache():
+	"""
+	Encoded (image, label) outputs under folder, one file per key, evicted least
+	recently used first once they take more than max_bytes
+	entries are written to a temporary file and renamed into place, so readers
+	in other processes see a complete entry or none; hits refresh the entry's
+	mtime, which is the recency eviction goes by
+	"""
+	def __init__(self, folder, max_bytes = 1 << 30):
+		self.folder = folder
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(folder, exist_ok=True)
+		self._lock = threading.Lock()
+		# estimate of the bytes held, other processes' writes are found by evict
+		self._size = None
+
+	def _path(self, key):
+		return os.path.join(self.folder, key[:2], key + ".bin")
+
+	def get(self, key):
+		"""
+		(image ext, image bytes, label ext, label bytes) cached under key, or None
+		"""
+		path = self._path(key)
+		try:
+			with open(path, "rb") as f:
+				header = json.loads(f.readline())
+				image_data = f.read(header["image_size"])
+				label_data = f.read(header["label_size"])
+			if len(image_data) != header["image_size"] or len(label_data) != header["label_size"]:
+				raise ValueError("truncated cache entry")
+			os.utime(path)
+		except (OSError, ValueError, KeyError):
+			# missing, or evicted by another process while being read
+			with self._lock:
+				self.misses += 1
+			return None
+		with self._lock:
+			self.hits += 1
+		return header["image_ext"], image_data, header["label_ext"], label_data
+
+	def put(self, key, image_ext, image_data, label_ext, label_data):
+		"""
+		Store the encoded outputs of key, evicting old entries when over max_bytes
+		"""
+		path = self._path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		header = json.dumps({"image_ext": image_ext, "image_size": len(image_data), "label_ext": label_ext, "label_size": len(label_data)})
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+		try:
+			with os.fdopen(fd, "wb") as f:
+				f.write(header.encode("utf-8") + b"\n")
+				f.write(image_data)
+				f.write(label_data)
+			os.replace(tmp_path, path)
+		except BaseException:
+			os.unlink(tmp_path)
+			raise
+		with self._lock:
+			if self._size is None:
+				self._size = self._scanSize()
+			else:
+				self._size += len(header) + 1 + len(image_data) + len(label_data)
+			full = self._size > self.max_bytes
+		if full:
+			self.evict()
+
+	def _entries(self):
+		"""
+		(mtime, size, path) of every entry, sweeping stale temporary files
+		"""
+		entries = []
+		now = time.time()
+		for root, _, files in os.walk(self.folder):
+			for file_name in files:
+				path = os.path.join(root, file_name)
+				try:
+					stat = os.stat(path)
+					if file_name.endswith(".tmp"):
+						if now - stat.st_mtime > _STALE_TMP:
+							os.unlink(path)
+						continue
+				except OSError:
+					continue
+				if file_name.endswith(".bin"):
+					entries.append((stat.st_mtime, stat.st_size, path))
+		return entries
+
+	def _scanSize(self):
+		return sum(size for _, size, _ in self._entries())
+
+	def evict(self, target = None):
+		"""
+		Remove least recently used entries until at most target bytes remain,
+		by default 90% of max_bytes so a full cache does not evict on every put
+		"""
+		target = int(self.max_bytes * 0.9) if target is None else target
+		entries = sorted(self._entries())
+		size = sum(size for _, size, _ in entries)
+		for _, entry_size, path in entries:
+			if size <= target:
+				break
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+			size -= entry_size
+		with self._lock:
+			self._size = size
+
+	def clear(self):
+		self.evict(0)
+		with self._lock:
+			self.hits = 0
+			self.misses = 0
+
+	def info(self):
+		with self._lock:
+			if self._size is None:
+				self._size = self._scanSize()
+			return {'hits': self.hits, 'misses': self.misses, 'bytes': self._size, 'max_bytes': self.max_bytes}
+
+
+def renderCached(cache, data, cfg, seed, image_ext = ".jpg", label_ext = ".png"):
+	"""
+	Encoded outputs of rendering the encoded image data with cfg and seed:
+	(image ext, image bytes, label ext, label bytes) like RenderCache.get
+	served from cache without decoding data when it holds them, otherwise
+	rendered, encoded with the encoders of cfg and stored; a failed store
+	(a full disk, say) is reported and the render returned all the same
+	"""
+	key = renderKey(data, cfg, seed, image_ext, label_ext)
+	entry = cache.get(key)
+	if entry is not None:
+		return entry
+	image, label = generateDropsFromImage(data, dict(cfg, return_label=True), as_array=True, rng=seed)
+	entry = encodeImage(image, cfg, image_ext) + encodeLabel(label, cfg, label_ext)
+	try:
+		cache.put(key, *entry)
+	except OSError as e:
+		print(f"Render cache store failed: {e}", file=sys.stderr)
+	return entry
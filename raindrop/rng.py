@@ -0,0 +1,38 @@
+import numpy as np
+"""
+Random number generators, every random draw of a render comes from one numpy Generator
+
+"""
+
+
+def makeRng(seed = None):
+	"""
+	numpy Generator for seed, which may be an int, a SeedSequence, a Generator
+	(returned as is) or None for fresh OS entropy; the global random and
+	numpy.random states are never used
+	"""
+	if isinstance(seed, np.random.Generator):
+		return seed
+	return np.random.default_rng(seed)
+
+
+def sampleSeed(seed, index, epoch = 0):
+	"""
+	Integer seed of sample index in epoch of a run seeded with seed, derived
+	through a SeedSequence so neighbouring samples and runs get independent streams
+	"""
+	return int(np.random.SeedSequence([int(seed), int(epoch), int(index)]).generate_state(1, np.uint64)[0])
+
+
+def randint(rng, low, high):
+	"""
+	Integer in [low, high], both ends included like random.randint
+	"""
+	return int(rng.integers(low, high, endpoint=True))
+
+
+def choice(rng, options):
+	"""
+	One element of a sequence, as the element itself rather than a numpy scalar
+	"""
+	return options[int(rng.integers(len(options)))]
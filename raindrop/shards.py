@@ -0,0 +1,144 @@
+import io
+import os
+import re
+import json
+import time
+import tarfile
+"""
+WebDataset style tar shards of rendered samples, with a byte offset index per shard
+
+"""
+
+SHARD_NAME = "shard-{:06d}.tar"
+# members of one sample share the key, the part of the name before the first dot
+_KEY_UNSAFE = re.compile(r"[.\s]")
+
+
+def sampleKey(name):
+	"""
+	Tar key of an input name, its extension dropped and dots replaced,
+	WebDataset splits member names into key and extension at the first dot
+	"""
+	key = os.path.splitext(name)[0].replace(os.sep, "/")
+	return _KEY_UNSAFE.sub("_", key)
+
+
+def indexPath(shard_path):
+	return shard_path + ".idx.json"
+
+
+class ShardWriter():
+	"""
+	Append samples to a numbered series of tar shards under folder with sequential
+	writes only, a new shard is started once max_count samples or max_bytes are
+	reached. A closed shard gets an index file next to it mapping every sample
+	key to {extension: [data offset, size]} inside the tar, and on_close(path, keys)
+	is called for it; shards without an index are incomplete
+	"""
+	def __init__(self, folder, max_count = 1000, max_bytes = 1 << 30, start = None, on_close = None):
+		self.folder = folder
+		self.max_count = max_count
+		self.max_bytes = max_bytes
+		self.on_close = on_close
+		os.makedirs(folder, exist_ok=True)
+		# continue after the last complete shard, a partial one is rewritten
+		self.number = nextShard(folder) if start is None else start
+		self.tar = None
+		self.path = None
+		self.index = {}
+
+	def _open(self):
+		self.path = os.path.join(self.folder, SHARD_NAME.format(self.number))
+		self.tar = tarfile.open(self.path, "w")
+		self.index = {}
+
+	def write(self, key, files):
+		"""
+		Add one sample, files maps member extension (e.g. "rain.jpg") to bytes
+		"""
+		if self.tar is None:
+			self._open()
+		if key in self.index:
+			raise ValueError(f"Duplicate sample key {key!r} in {self.path}")
+		entry = {}
+		mtime = time.time()
+		for ext, data in files.items():
+			info = tarfile.TarInfo(f"{key}.{ext}")
+			info.size = len(data)
+			info.mtime = mtime
+			self.tar.addfile(info, io.BytesIO(data))
+			# the data block ends on the 512 byte boundary the tar offset is now at
+			entry[ext] = [self.tar.offset - _padded(info.size), info.size]
+		self.index[key] = entry
+		if len(self.index) >= self.max_count or self.tar.offset >= self.max_bytes:
+			self.closeShard()
+
+	def closeShard(self):
+		if self.tar is None:
+			return
+		self.tar.close()
+		tmp_path = indexPath(self.path) + ".tmp"
+		with open(tmp_path, "w", encoding="utf-8") as f:
+			json.dump(self.index, f)
+		os.replace(tmp_path, indexPath(self.path))
+		if self.on_close is not None:
+			self.on_close(self.path, list(self.index))
+		self.tar = None
+		self.number += 1
+
+	def close(self):
+		self.closeShard()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def _padded(size):
+	return (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+
+
+def listShards(folder):
+	"""
+	Names of the shards, complete or not, and shard indexes in folder
+	"""
+	if not os.path.isdir(folder):
+		return []
+	return sorted(f for f in os.listdir(folder) if re.fullmatch(r"shard-\d+\.tar(\.idx\.json(\.tmp)?)?", f))
+
+
+def nextShard(folder):
+	"""
+	Number of the shard after the last one with an index in folder
+	"""
+	numbers = [-1]
+	if os.path.isdir(folder):
+		for file_name in os.listdir(folder):
+			match = re.fullmatch(r"shard-(\d+)\.tar\.idx\.json", file_name)
+			if match:
+				numbers.append(int(match.group(1)))
+	return max(numbers) + 1
+
+
+def loadIndex(shard_path):
+	with open(indexPath(shard_path), "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+def readSample(shard_path, key, index = None, exts = None):
+	"""
+	Read the members of one sample straight from their byte offsets, without scanning the shard
+	returns {extension: bytes}, limited to exts when given
+	"""
+	index = loadIndex(shard_path) if index is None else index
+	entry = index[key]
+	sample = {}
+	with open(shard_path, "rb") as f:
+		for ext, (offset, size) in entry.items():
+			if exts is not None and ext not in exts:
+				continue
+			f.seek(offset)
+			sample[ext] = f.read(size)
+	return sample
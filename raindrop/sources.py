@@ -0,0 +1,75 @@
+import os
+import tarfile
+import zipfile
+import posixpath
+"""
+Input images streamed straight out of tar / zip archives, without extracting them
+
+"""
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip')
+
+
+def isArchive(path):
+	return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def archivePrefix(path):
+	"""
+	Name of an archive without its archive extension, used to prefix its members
+	"""
+	name = os.path.basename(path)
+	for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+		if name.lower().endswith(ext):
+			return name[:-len(ext)]
+	return name
+
+
+def listArchives(folder):
+	"""
+	Paths of the archives below folder, sorted
+	"""
+	paths = []
+	for root, _, files in os.walk(folder):
+		for file_name in files:
+			if isArchive(file_name):
+				paths.append(os.path.join(root, file_name))
+	return sorted(paths)
+
+
+def memberName(name):
+	"""
+	Normalised name of an archive member, "./img/1.jpg" (tar -C dir .) and
+	"img//1.jpg" both become "img/1.jpg"; None for names leaving the archive
+	root, such as "../1.jpg", which would be written outside the output folder
+	"""
+	name = posixpath.normpath(name).lstrip("/")
+	if name in (".", "..") or name.startswith("../"):
+		return None
+	return name
+
+
+def iterArchive(path, skip = None):
+	"""
+	Yield (member name, encoded bytes) for the images of a tar or zip archive,
+	reading it front to back once; tars (also compressed) are read as a stream
+	names are normalised with memberName, members named in skip are passed
+	over without being returned
+	"""
+	skip = skip or ()
+	if path.lower().endswith('.zip'):
+		with zipfile.ZipFile(path) as archive:
+			# in stored order, so the file is read sequentially
+			for info in sorted(archive.infolist(), key=lambda info: info.header_offset):
+				name = memberName(info.filename)
+				if info.is_dir() or name is None or not name.lower().endswith(IMAGE_EXTENSIONS) or name in skip:
+					continue
+				yield name, archive.read(info)
+		return
+	with tarfile.open(path, "r|*") as archive:
+		for member in archive:
+			name = memberName(member.name)
+			if not member.isfile() or name is None or not name.lower().endswith(IMAGE_EXTENSIONS) or name in skip:
+				continue
+			yield name, archive.extractfile(member).read()
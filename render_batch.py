@@ -0,0 +1,77 @@
+import os
+import ast
+import time
+import argparse
+from raindrop.batch import runBatch, listImages
+from raindrop.procedural import writeIndex
+from raindrop.sources import isArchive
+from raindrop.shards import listShards
+from raindrop.config import cfg
+
+
+def parseOverride(text):
+	"""
+	key=value config override, the value is read as a Python literal when it parses as one
+	"""
+	key, _, value = text.partition("=")
+	if key not in cfg:
+		raise argparse.ArgumentTypeError(f"unknown config key {key!r}")
+	try:
+		value = ast.literal_eval(value)
+	except (ValueError, SyntaxError):
+		pass
+	return key, value
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Render raindrops onto every image of a folder on all cores")
+	parser.add_argument("--images", default="./datasets", help="folder with input images and tar / zip archives, searched recursively, or a single archive; with fewer archives than workers each archive is split across workers")
+	parser.add_argument("--output-images", default="./Output_image")
+	parser.add_argument("--output-labels", default="./Output_label")
+	parser.add_argument("--manifest", default=None, help="JSONL manifest, defaults to manifest.jsonl in the image output folder")
+	parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+	parser.add_argument("--chunk-size", type=int, default=8, help="images handed to a worker at a time")
+	parser.add_argument("--seed", type=int, default=0, help="run seed, every image derives its own seed from it")
+	parser.add_argument("--resume", action="store_true", help="skip the images the manifest already completed")
+	parser.add_argument("--no-warm", action="store_true", help="do not prebuild the fisheye maps in every worker")
+	parser.add_argument("--shards", default=None, help="write tar shards with a byte offset index to this folder instead of image files")
+	parser.add_argument("--shard-count", type=int, default=1000, help="samples per shard")
+	parser.add_argument("--shard-mb", type=int, default=1024, help="shard size limit in MiB")
+	parser.add_argument("--shard-clean", action="store_true", help="also store the clean input image in every sample")
+	parser.add_argument("--cache", default=None, metavar="DIR", help="render cache shared by runs, unchanged inputs are copied from it instead of rendered")
+	parser.add_argument("--cache-mb", type=int, default=1024, help="render cache size limit in MiB")
+	parser.add_argument("--procedural", default=None, metavar="INDEX", help="write a procedural dataset index (source, config, seed per sample) instead of rendering")
+	parser.add_argument("--variants", type=int, default=1, help="samples per image in a procedural index")
+	parser.add_argument("--set", type=parseOverride, action="append", default=[], metavar="KEY=VALUE", help="override a config entry, e.g. --set maxDrops=50")
+	args = parser.parse_args()
+
+	if not (os.path.isdir(args.images) or (os.path.isfile(args.images) and isArchive(args.images))):
+		print(f"Warning: {args.images} not found. Please add images to the datasets directory.")
+		return
+	run_cfg = dict(cfg)
+	run_cfg.update(args.set)
+	if args.procedural is not None:
+		if not os.path.isdir(args.images):
+			print("Procedural indexes read their images from a folder, archives are not supported")
+			return
+		count = writeIndex(args.procedural, listImages(args.images), run_cfg, variants=args.variants, seed=args.seed, root=os.path.abspath(args.images))
+		print(f"indexed {count} samples: {args.procedural}")
+		return
+	if args.shards is not None and not args.resume and listShards(args.shards):
+		print(f"{args.shards} already holds shards, pass --resume to continue that run or choose an empty folder")
+		return
+	manifest_dir = args.shards or args.output_images
+	os.makedirs(manifest_dir, exist_ok=True)
+	manifest = args.manifest or os.path.join(manifest_dir, "manifest.jsonl")
+
+	start = time.perf_counter()
+	rendered, failed, skipped = runBatch(args.images, args.output_images, args.output_labels, run_cfg, manifest,
+		seed=args.seed, workers=args.workers, chunk_size=args.chunk_size, resume=args.resume, warm=not args.no_warm,
+		shard_dir=args.shards, shard_count=args.shard_count, shard_bytes=args.shard_mb << 20, shard_clean=args.shard_clean,
+		cache_dir=args.cache, cache_bytes=args.cache_mb << 20)
+	elapsed = time.perf_counter() - start
+	print(f"rendered {rendered}, failed {failed}, skipped {skipped} in {elapsed:.1f} s ({rendered / max(elapsed, 1e-9):.1f} img/s)")
+	print(f"manifest: {manifest}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Make the raindrop package importable when running `pytest tests/`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def test_image():
+    """Small noisy RGB frame, refraction of noise shows every drop change."""
+    return np.random.default_rng(0).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def image_folder(tmp_path, test_image):
+    """Folder holding test_image as a.png and a shifted copy as b.png."""
+    Image.fromarray(test_image).save(tmp_path / "a.png")
+    Image.fromarray(np.roll(test_image, 7, axis=1)).save(tmp_path / "b.png")
+    return tmp_path
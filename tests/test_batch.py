@@ -0,0 +1,48 @@
+import errno
+import io
+import json
+import os
+import tarfile
+
+from raindrop import batch
+from raindrop.config import cfg
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.pipeline import Rendered
+from raindrop.rendercache import RenderCache
+
+SMALL = dict(cfg, maxR=20, minR=10, maxDrops=8, minDrops=8, return_label=True)
+
+
+def _fullDisk(*args, **kwargs):
+    raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+
+class TestWriteOutputs:
+    def test_failed_cache_store_still_writes_outputs(self, tmp_path, monkeypatch, test_image):
+        """A render cache that can not store an entry does not fail the image."""
+        cache = RenderCache(str(tmp_path / "cache"))
+        monkeypatch.setattr(cache, "put", _fullDisk)
+        monkeypatch.setattr(batch, "_worker_cache", cache)
+        image, label = generateDropsFromImage(test_image, SMALL, as_array=True, rng=1)
+        item = (b"input bytes", "a.png", 1, str(tmp_path / "img" / "a.png"), str(tmp_path / "lab" / "a.png"))
+        record = batch.writeOutputs(Rendered(item, image, label, 0.0, None), SMALL)
+        assert "error" not in record
+        assert record["cache_error"].startswith("OSError")
+        assert os.path.exists(record["image"]) and os.path.exists(record["label"])
+
+
+class TestRunBatch:
+    def test_single_archive_split_across_workers(self, tmp_path, image_folder):
+        """Every member of a lone archive is rendered once when the archive is split."""
+        path = str(tmp_path / "arch.tar")
+        with tarfile.open(path, "w") as archive:
+            archive.add(str(image_folder / "a.png"), "./a.png")
+            archive.add(str(image_folder / "b.png"), "./sub/b.png")
+        manifest = str(tmp_path / "manifest.jsonl")
+        rendered, failed, skipped = batch.runBatch(path, str(tmp_path / "img"), str(tmp_path / "lab"), SMALL, manifest,
+            workers=2, warm=False, stream=io.StringIO())
+        assert (rendered, failed, skipped) == (2, 0, 0)
+        with open(manifest, "r", encoding="utf-8") as f:
+            inputs = sorted(json.loads(line)["input"] for line in f)
+        assert inputs == ["arch/a.png", "arch/sub/b.png"]
+        assert os.path.exists(tmp_path / "img" / "arch" / "sub" / "b.png")
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from raindrop.collision import SpatialHash, UnionFind, findCollisions
+from raindrop.config import cfg
+from raindrop.dropgenerator import CheckCollision, layoutDrops
+from raindrop.droptable import DropTable
+from raindrop.placement import _conflicts, samplePoissonDisk
+from raindrop.raindrop import sampleSprite
+
+CROWDED = dict(cfg, maxR=20, minR=10, maxDrops=60, minDrops=60, shape_variety=True)
+
+
+def _fullPasses(table, imgh, imgw, passes):
+    # reference for the incremental passes of layoutDrops: a fresh index and every row checked each pass
+    for _ in range(passes):
+        index = SpatialHash(5 * CROWDED['maxR'])
+        for ident, box in zip(table.ident.tolist(), table.boxes().tolist()):
+            index.insert(ident, tuple(box))
+        if findCollisions(table, index, imgh, imgw) == 0:
+            break
+        table = CheckCollision(table)
+    return table
+
+
+class TestUnionFind:
+    def test_groups_are_transitive(self):
+        """Chained unions end up in one group, ordered by first member."""
+        groups = UnionFind(6)
+        groups.union(4, 1)
+        groups.union(1, 3)
+        groups.union(5, 2)
+        assert groups.groups() == [[0], [1, 3, 4], [2, 5]]
+        assert groups.find(3) == groups.find(4)
+
+
+class TestSpatialHash:
+    def test_query_matches_brute_force(self):
+        """Queries return exactly the overlapping boxes, also after removals."""
+        rng = np.random.default_rng(0)
+        index = SpatialHash(16)
+        boxes = {}
+        for item in range(200):
+            x, y = rng.integers(-20, 200, 2).tolist()
+            w, h = rng.integers(1, 40, 2).tolist()
+            boxes[item] = (x, y, x + w, y + h)
+            index.insert(item, boxes[item])
+        for item in range(0, 200, 3):
+            index.remove(item)
+            del boxes[item]
+        assert len(index) == len(boxes)
+        for _ in range(50):
+            x, y = rng.integers(-20, 200, 2).tolist()
+            query = (x, y, x + 30, y + 25)
+            expected = {i for i, b in boxes.items() if b[0] < query[2] and query[0] < b[2] and b[1] < query[3] and query[1] < b[3]}
+            assert set(index.query(query)) == expected
+
+
+class TestCollisions:
+    def test_merge_preserves_area(self):
+        """Two colliding drops merge into one at their radius weighted center."""
+        rng = np.random.default_rng(1)
+        table = DropTable.fromDrops([(50, 50), (60, 52)], [10, 20], [sampleSprite(10, None, rng), sampleSprite(20, None, rng)])
+        table.setCollisions([1], [0])
+        merged = CheckCollision(table)
+        assert len(merged) == 1
+        assert int(merged.radius[0]) == round(np.sqrt(10 * 10 + 20 * 20))
+        assert (int(merged.x[0]), int(merged.y[0])) == (round((10 * 50 + 20 * 60) / 30), round((10 * 50 + 20 * 52) / 30))
+        assert merged.sprites[merged.sprite[0]].parts
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_incremental_passes_match_full_passes(self, seed):
+        """Re-checking only the rows a merge touched gives the same drops as re-checking all."""
+        start = layoutDrops(120, 160, dict(CROWDED, max_merge_passes=0), rng=seed)
+        expected = _fullPasses(start, 120, 160, CROWDED['max_merge_passes'])
+        table = layoutDrops(120, 160, CROWDED, rng=seed)
+        assert len(table) < len(start)
+        np.testing.assert_array_equal(table.x, expected.x)
+        np.testing.assert_array_equal(table.y, expected.y)
+        np.testing.assert_array_equal(table.radius, expected.radius)
+
+
+class TestPoissonDisk:
+    def test_centers_do_not_conflict(self):
+        """With room to spare, no center lands in another drop's footprint."""
+        radii = [5] * 20
+        centers = samplePoissonDisk(radii, 400, 300, rng=0)
+        assert len(centers) == len(radii)
+        for n, (x, y) in enumerate(centers):
+            for m in range(n):
+                ox, oy = centers[m]
+                assert not _conflicts(x, y, radii[n], ox, oy, radii[m])
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from raindrop.config import cfg
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.layout import DropLayout
+
+RAIN = dict(cfg, maxR=20, minR=10, maxDrops=12, minDrops=12, return_label=True)
+
+
+class TestDropLayout:
+    @pytest.mark.parametrize("ext", [".json", ".npz"])
+    def test_saved_layout_replays_render(self, tmp_path, test_image, ext):
+        """A saved and loaded layout renders the pixels of the render it was sampled from."""
+        expected_image, expected_label = generateDropsFromImage(test_image, RAIN, as_array=True, rng=4)
+        path = str(tmp_path / ("layout" + ext))
+        DropLayout.sample(120, 160, RAIN, rng=4).save(path)
+        layout = DropLayout.load(path)
+        assert (layout.height, layout.width) == (120, 160)
+        image, label = layout.apply(test_image, RAIN)
+        np.testing.assert_array_equal(image, expected_image)
+        np.testing.assert_array_equal(label, expected_label)
+
+    def test_input_label_layout_needs_npz(self, tmp_path, test_image):
+        """Layouts read from an input label keep their arrays in NPZ and refuse JSON."""
+        mask = np.zeros((120, 160, 3), dtype=np.uint8)
+        mask[20:50, 30:60] = 255
+        mask[70:100, 100:140] = 200
+        input_label = Image.fromarray(mask)
+        expected = generateDropsFromImage(test_image, RAIN, input_label, as_array=True, rng=0)
+        layout = DropLayout.sample(120, 160, RAIN, input_label, rng=0)
+        assert len(layout) == 2
+        with pytest.raises(ValueError):
+            layout.save(str(tmp_path / "layout.json"))
+        layout.save(str(tmp_path / "layout.npz"))
+        image, label = DropLayout.load(str(tmp_path / "layout.npz")).apply(test_image, RAIN)
+        np.testing.assert_array_equal(image, expected[0])
+        np.testing.assert_array_equal(label, expected[1])
+
+    def test_lens_layer_label_matches(self, test_image):
+        """A baked lens layer labels the same pixels as compositing drop by drop."""
+        layout = DropLayout.sample(120, 160, RAIN, rng=2)
+        _, label = layout.apply(test_image, RAIN)
+        np.testing.assert_array_equal(layout.lensLayer(RAIN).label, label)
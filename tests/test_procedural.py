@@ -0,0 +1,48 @@
+import numpy as np
+
+from raindrop.config import cfg
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.pipeline import loadImage
+from raindrop.procedural import ProceduralDataset, cfgFingerprint, normalizeCfg, writeIndex
+
+SMALL = {'maxR': 20, 'minR': 10, 'maxDrops': 8, 'minDrops': 8, 'edge_darkratio': 0.3, 'label_thres': 128}
+
+
+class TestNormalizeCfg:
+    def test_missing_entries_use_renderer_defaults(self):
+        """Entries left out of a cfg normalize to what the renderer falls back to."""
+        partial = dict(SMALL, shape_variety=True)
+        explicit = dict(partial, allowed_shapes=["default"])
+        assert normalizeCfg(partial) == normalizeCfg(explicit)
+        assert cfgFingerprint(partial) != cfgFingerprint(dict(partial, allowed_shapes=cfg['allowed_shapes']))
+
+    def test_render_irrelevant_entries_ignored(self):
+        """Encoder settings, return_label and unused shapes share a fingerprint."""
+        base = dict(SMALL, shape_variety=False)
+        other = dict(base, allowed_shapes=["splash"], jpeg_quality=10, return_label=True)
+        assert cfgFingerprint(base) == cfgFingerprint(other)
+
+
+class TestProceduralDataset:
+    def test_replay_matches_direct_render(self, tmp_path, image_folder):
+        """A sample renders like generateDropsFromImage with its config and seed."""
+        run_cfg = dict(SMALL, shape_variety=True)
+        index = str(tmp_path / "rain.json")
+        assert writeIndex(index, ["a.png", "b.png"], run_cfg, variants=2, seed=3, root=str(image_folder)) == 4
+        dataset = ProceduralDataset(index)
+        for i in range(len(dataset)):
+            path, _, seed = dataset.sample(i)
+            image, label = dataset[i]
+            expected_image, expected_label = generateDropsFromImage(loadImage(path), dict(run_cfg, return_label=True), as_array=True, rng=seed)
+            np.testing.assert_array_equal(image, expected_image)
+            np.testing.assert_array_equal(label, expected_label)
+
+    def test_reads_are_deterministic(self, tmp_path, image_folder):
+        """Every read of a sample, cached or not, returns the same pixels."""
+        index = str(tmp_path / "rain.json")
+        writeIndex(index, ["a.png"], SMALL, variants=3, seed=0, root=str(image_folder))
+        plain = ProceduralDataset(index)
+        cached = ProceduralDataset(index, cache_size=2, source_cache_size=1)
+        for i, image, label in cached.iterate(threads=2, prefetch=2):
+            np.testing.assert_array_equal(image, plain[i][0])
+            np.testing.assert_array_equal(label, plain[i][1])
@@ -0,0 +1,21 @@
+import numpy as np
+from PIL import Image
+
+from raindrop.raindrop import raindrop
+
+
+class TestRaindrop:
+    def test_texture_none_before_update(self):
+        """getTexture returns None until updateTexture, as the original class did."""
+        drop = raindrop(0, (40, 40), 12, rng=1)
+        assert drop.getTexture() is None
+        assert drop.getTextureArray() is None
+
+    def test_texture_after_update(self, test_image):
+        """updateTexture refracts the background into an RGBA texture of the sprite size."""
+        drop = raindrop(0, (40, 40), 12, rng=1)
+        drop.updateTexture(test_image[:60, :48])
+        texture = drop.getTexture()
+        assert isinstance(texture, Image.Image) and texture.mode == 'RGBA'
+        assert texture.size == drop.getAlphaMap().shape[::-1]
+        np.testing.assert_array_equal(np.asarray(texture), drop.getTextureArray())
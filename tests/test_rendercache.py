@@ -0,0 +1,123 @@
+import errno
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from raindrop.config import cfg
+from raindrop.dropgenerator import generateDropsFromImage
+from raindrop.rendercache import RenderCache, renderCached, renderKey
+
+SMALL = {'maxR': 20, 'minR': 10, 'maxDrops': 8, 'minDrops': 8, 'edge_darkratio': 0.3, 'label_thres': 128}
+
+
+@pytest.fixture
+def data(test_image):
+    buffer = io.BytesIO()
+    Image.fromarray(test_image).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _render(data, run_cfg, seed):
+    return generateDropsFromImage(data, dict(run_cfg, return_label=True), as_array=True, rng=seed)
+
+
+class TestRenderKey:
+    @pytest.mark.parametrize("first, second", [
+        (dict(SMALL, shape_variety=True), dict(SMALL, shape_variety=True, allowed_shapes=cfg['allowed_shapes'])),
+        (SMALL, dict(SMALL, placement="poisson")),
+        (SMALL, dict(SMALL, maxDrops=9)),
+    ])
+    def test_different_renders_different_keys(self, data, first, second):
+        """Configs that render different pixels never share a key."""
+        assert not all(np.array_equal(a, b) for a, b in zip(_render(data, first, 5), _render(data, second, 5)))
+        assert renderKey(data, first, 5) != renderKey(data, second, 5)
+
+    def test_equal_renders_equal_keys(self, data):
+        """Spelling out the renderer's defaults or return_label keeps the key."""
+        explicit = dict(SMALL, shape_variety=False, placement="uniform", return_label=True)
+        assert renderKey(data, SMALL, 5) == renderKey(data, explicit, 5)
+
+    def test_inputs_outside_cfg_change_the_key(self, data):
+        """Seed, input bytes, encoder settings and extensions are all keyed."""
+        key = renderKey(data, SMALL, 5)
+        assert key != renderKey(data, SMALL, 6)
+        assert key != renderKey(data + b"\0", SMALL, 5)
+        assert key != renderKey(data, dict(SMALL, jpeg_quality=10), 5)
+        assert key != renderKey(data, SMALL, 5, image_ext=".png")
+
+    def test_seed_must_be_an_integer(self, data):
+        """Unseeded renders can not be cached."""
+        with pytest.raises(TypeError):
+            renderKey(data, SMALL, None)
+        with pytest.raises(TypeError):
+            renderKey(data, SMALL, True)
+
+
+class TestRenderCached:
+    def test_second_call_is_a_hit(self, tmp_path, data):
+        """A stored render is served from the cache byte for byte."""
+        cache = RenderCache(str(tmp_path))
+        first = renderCached(cache, data, SMALL, 5, ".png", ".png")
+        assert renderCached(cache, data, SMALL, 5, ".png", ".png") == first
+        assert cache.info()["hits"] == 1
+
+    def test_failed_store_returns_the_render(self, tmp_path, monkeypatch, data, capsys):
+        """A full disk is reported, the render is returned all the same."""
+        cache = RenderCache(str(tmp_path))
+        def full(*args):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        monkeypatch.setattr(cache, "put", full)
+        entry = renderCached(cache, data, SMALL, 5, ".png", ".png")
+        assert entry == renderCached(RenderCache(str(tmp_path / "other")), data, SMALL, 5, ".png", ".png")
+        assert "Render cache store failed" in capsys.readouterr().err
+
+
+class TestRenderCache:
+    def _fill(self, cache, keys):
+        # entries of 1000 bytes with mtimes a minute apart, oldest first
+        for n, key in enumerate(keys):
+            cache.put(key, ".jpg", b"i" * 600, ".png", b"l" * 300)
+            os.utime(cache._path(key), (1000 + 60 * n, 1000 + 60 * n))
+
+    def test_round_trip(self, tmp_path):
+        """An entry comes back with its extensions and bytes."""
+        cache = RenderCache(str(tmp_path))
+        cache.put("ab" * 32, ".jpg", b"image", ".png", b"")
+        assert cache.get("ab" * 32) == (".jpg", b"image", ".png", b"")
+        assert cache.get("cd" * 32) is None
+        assert (cache.info()["hits"], cache.info()["misses"]) == (1, 1)
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """Once over max_bytes the oldest entries go first, a hit makes an entry recent."""
+        cache = RenderCache(str(tmp_path), max_bytes=10 ** 6)
+        keys = [f"{n:02d}" * 32 for n in range(5)]
+        self._fill(cache, keys)
+        entry = os.path.getsize(cache._path(keys[0]))
+        assert cache.get(keys[0]) is not None
+        cache.evict(3 * entry)
+        assert [cache.get(key) is not None for key in keys] == [True, False, False, True, True]
+        assert cache.info()["bytes"] == 3 * entry
+
+    def test_put_over_limit_evicts(self, tmp_path):
+        """A put that takes the cache over max_bytes trims it to 90% of the limit."""
+        cache = RenderCache(str(tmp_path), max_bytes=10 ** 6)
+        keys = [f"{n:02d}" * 32 for n in range(4)]
+        self._fill(cache, keys)
+        entry = os.path.getsize(cache._path(keys[0]))
+        cache.max_bytes = int(4.5 * entry)
+        cache.put("ff" * 32, ".jpg", b"i" * 600, ".png", b"l" * 300)
+        assert [cache.get(key) is not None for key in keys + ["ff" * 32]] == [False, True, True, True, True]
+
+    def test_truncated_entry_is_a_miss(self, tmp_path):
+        """An entry cut short is not served."""
+        cache = RenderCache(str(tmp_path))
+        cache.put("ab" * 32, ".jpg", b"image", ".png", b"label")
+        path = cache._path("ab" * 32)
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:-2])
+        assert cache.get("ab" * 32) is None
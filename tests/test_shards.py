@@ -0,0 +1,70 @@
+import os
+import tarfile
+
+import pytest
+
+from raindrop.batch import runBatch
+from raindrop.config import cfg
+from raindrop.shards import ShardWriter, listShards, loadIndex, nextShard, readSample, sampleKey
+
+
+def _sample(n):
+    # sizes around the 512 byte tar block, including empty members
+    return {"rain.jpg": bytes([n]) * (n * 97 % 1300), "label.png": os.urandom(n * 31 % 600), "json": b"{}"}
+
+
+class TestShardWriter:
+    def test_offsets_match_tar_members(self, tmp_path):
+        """readSample returns every member's bytes straight from the index offsets."""
+        closed = []
+        samples = {f"img/{n}": _sample(n) for n in range(12)}
+        with ShardWriter(str(tmp_path), max_count=5, on_close=lambda path, keys: closed.append((os.path.basename(path), keys))) as writer:
+            for key, files in samples.items():
+                writer.write(key, files)
+        assert [(name, len(keys)) for name, keys in closed] == [("shard-000000.tar", 5), ("shard-000001.tar", 5), ("shard-000002.tar", 2)]
+        assert nextShard(str(tmp_path)) == 3
+        for name, keys in closed:
+            path = str(tmp_path / name)
+            index = loadIndex(path)
+            assert list(index) == keys
+            with tarfile.open(path) as archive:
+                members = {m.name: archive.extractfile(m).read() for m in archive}
+            for key in keys:
+                assert readSample(path, key, index) == samples[key]
+                assert readSample(path, key, exts={"json"}) == {"json": b"{}"}
+                for ext, data in samples[key].items():
+                    assert members[f"{key}.{ext}"] == data
+
+    def test_duplicate_key_refused(self, tmp_path):
+        """A key written twice to one shard raises instead of shadowing the first sample."""
+        with ShardWriter(str(tmp_path)) as writer:
+            writer.write("a", {"json": b"1"})
+            with pytest.raises(ValueError):
+                writer.write("a", {"json": b"2"})
+
+    def test_resume_continues_after_complete_shards(self, tmp_path):
+        """A shard without an index is incomplete and is written again."""
+        with ShardWriter(str(tmp_path), max_count=1) as writer:
+            writer.write("a", {"json": b"1"})
+        (tmp_path / "shard-000001.tar").write_bytes(b"partial")
+        assert ShardWriter(str(tmp_path)).number == 1
+
+
+class TestSampleKey:
+    def test_dots_and_spaces_replaced(self):
+        """Keys keep the folders and never contain the member extension separator."""
+        assert sampleKey("arch/sub dir/1.2.jpg") == "arch/sub_dir/1_2"
+
+
+class TestFreshRun:
+    def test_refuses_folder_with_shards(self, tmp_path, image_folder):
+        """A run without resume does not mix its shards with an earlier run's."""
+        shard_dir = tmp_path / "shards"
+        with ShardWriter(str(shard_dir)) as writer:
+            writer.write("old", {"rain.jpg": b"old"})
+        manifest = shard_dir / "manifest.jsonl"
+        manifest.write_text("kept\n")
+        with pytest.raises(FileExistsError):
+            runBatch(str(image_folder), None, None, cfg, str(manifest), shard_dir=str(shard_dir))
+        assert listShards(str(shard_dir)) == ["shard-000000.tar", "shard-000000.tar.idx.json"]
+        assert manifest.read_text() == "kept\n"
@@ -0,0 +1,47 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from raindrop.sources import iterArchive, memberName
+
+
+def _addMember(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+class TestMemberName:
+    @pytest.mark.parametrize("name, expected", [
+        ("./img/1.jpg", "img/1.jpg"),
+        ("img//1.jpg", "img/1.jpg"),
+        ("/img/1.jpg", "img/1.jpg"),
+        ("img/../1.jpg", "1.jpg"),
+        ("../1.jpg", None),
+        ("./", None),
+    ])
+    def test_normalised(self, name, expected):
+        """Names are normalised the way tar -C dir . archives need."""
+        assert memberName(name) == expected
+
+
+class TestIterArchive:
+    def test_tar_names_normalised(self, tmp_path):
+        """Members of a tar -C dir . archive come out without ./ and outside members are dropped."""
+        path = str(tmp_path / "arch.tar")
+        with tarfile.open(path, "w") as archive:
+            _addMember(archive, "./img/1.jpg", b"one")
+            _addMember(archive, "./img/notes.txt", b"text")
+            _addMember(archive, "../2.jpg", b"two")
+        assert list(iterArchive(path)) == [("img/1.jpg", b"one")]
+        assert list(iterArchive(path, skip={"img/1.jpg"})) == []
+
+    def test_zip_in_stored_order(self, tmp_path):
+        """Zip members are read in stored order with normalised names."""
+        path = str(tmp_path / "arch.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("./b.png", b"b")
+            archive.writestr("a.png", b"a")
+        assert list(iterArchive(path)) == [("b.png", b"b"), ("a.png", b"a")]